@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 # filepath: /workspaces/dbt-duckdb/download_population.py
 import os
-import subprocess
 import tempfile
 import argparse
-import pandas as pd
 import shutil
 import asyncio
-import httpx
+import aiohttp
+import duckdb
+import orjson
+from pipeline_common import PARQUET_ZSTD_LEVEL
+from r2_sync import sync_to_r2
 
 # World Bank API for total population (SP.POP.TOTL) for 2022.
 POPULATION_SERVICE_URL = "https://api.worldbank.org/v2/country/all/indicator/SP.POP.TOTL?format=json&date=2022"
@@ -16,30 +18,42 @@ POPULATION_SERVICE_URL = "https://api.worldbank.org/v2/country/all/indicator/SP.
 # The Parquet file will be synced to the "sources" folder.
 R2_BUCKET_POP = "r2:wdi"
 
+# Fields read from each World Bank record; everything else is ignored.
+# Population values can be missing, so they are read as doubles (as pandas did).
+RECORD_JSON_STRUCTURE = '[{"countryiso3code": "VARCHAR", "value": "DOUBLE"}]'
 
-async def fetch_page(client, page, per_page):
+
+def page_filename(pages_dir, page):
+    # save_population_parquet reads the fetch's list of these paths in page
+    # order; zero-padding keeps the files sorted the same way on disk.
+    return os.path.join(pages_dir, f"page_{page:05d}.json")
+
+
+async def fetch_bytes(client, url):
+    async with client.get(url) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+async def fetch_page(client, page, per_page, pages_dir):
     url = f"{POPULATION_SERVICE_URL}&page={page}&per_page={per_page}"
-    response = await client.get(url)
-    response.raise_for_status()
-    data = response.json()
-    # The second element has the data records.
-    records = data[1] if len(data) > 1 else []
-    return records
+    body = await fetch_bytes(client, url)
+    # Keep the raw response; DuckDB parses all pages in one pass later.
+    with open(page_filename(pages_dir, page), "wb") as f:
+        f.write(body)
+    return body
 
 
-async def fetch_population_data_async():
+async def fetch_population_data_async(pages_dir):
     print("Fetching population data from World Bank API...")
-    pop_list = []
     try:
         page = 1
         per_page = 1000  # adjust as necessary
 
-        async with httpx.AsyncClient(follow_redirects=True) as client:
+        connector = aiohttp.TCPConnector(limit=20)
+        async with aiohttp.ClientSession(connector=connector) as client:
             # Fetch first page to get total pages
-            url = f"{POPULATION_SERVICE_URL}&page={page}&per_page={per_page}"
-            response = await client.get(url)
-            response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(await fetch_page(client, page, per_page, pages_dir))
 
             if not data:
                 return []
@@ -47,14 +61,7 @@ async def fetch_population_data_async():
             pagination = data[0]
             total_pages = pagination.get("pages", 1)
             print(f"Total pages to fetch: {total_pages}")
-
-            # Get records from first page
-            records = data[1] if len(data) > 1 else []
-            print(f"Retrieved {len(records)} records from page {page} of {total_pages}.")
-            pop_list.extend(
-                {"country_code": row.get("countryiso3code"), "population": row.get("value")}
-                for row in records if row.get("countryiso3code") is not None
-            )
+            print(f"Retrieved page {page} of {total_pages}.")
 
             # Fetch remaining pages concurrently
             if total_pages > 1:
@@ -62,56 +69,42 @@ async def fetch_population_data_async():
 
                 async def fetch_with_semaphore(p):
                     async with semaphore:
-                        return await fetch_page(client, p, per_page)
-
-                tasks = []
-                for p in range(2, total_pages + 1):
-                    tasks.append(fetch_with_semaphore(p))
-
-                results = await asyncio.gather(*tasks)
+                        await fetch_page(client, p, per_page, pages_dir)
+                    print(f"Retrieved page {p} of {total_pages}.")
 
-                for i, records in enumerate(results):
-                    current_page = i + 2
-                    print(f"Retrieved {len(records)} records from page {current_page} of {total_pages}.")
-                    pop_list.extend(
-                        {"country_code": row.get("countryiso3code"), "population": row.get("value")}
-                        for row in records if row.get("countryiso3code") is not None
-                    )
+                await asyncio.gather(*(fetch_with_semaphore(p) for p in range(2, total_pages + 1)))
 
-        print(f"Total population data records: {len(pop_list)}")
-        return pop_list
+        return [page_filename(pages_dir, p) for p in range(1, total_pages + 1)]
     except Exception as e:
         print(f"Error fetching population data: {e}")
         return []
 
-def fetch_population_data():
-    return asyncio.run(fetch_population_data_async())
+def fetch_population_data(pages_dir):
+    return asyncio.run(fetch_population_data_async(pages_dir))
 
 
-def save_population_parquet(pop_list, dest_file):
+def save_population_parquet(page_files, dest_file):
     print(f"Saving population data to Parquet file {dest_file} ...")
     try:
-        df = pd.DataFrame(pop_list)
-        df.to_parquet(dest_file, engine="pyarrow", index=False)
-        print(f"Saved population data as Parquet to {dest_file}.")
+        # The second element of each page is the array of records; DuckDB
+        # unnests and types them without building any Python objects.
+        copy_query = f"""
+        COPY (
+            SELECT r.countryiso3code AS country_code, r.value AS population
+            FROM (
+                SELECT unnest(from_json(json_extract(content, '$[1]'), '{RECORD_JSON_STRUCTURE}')) AS r
+                FROM read_text(?)
+            )
+            WHERE r.countryiso3code IS NOT NULL
+        ) TO '{dest_file}' (FORMAT PARQUET, COMPRESSION ZSTD, COMPRESSION_LEVEL {PARQUET_ZSTD_LEVEL})
+        """
+        with duckdb.connect() as con:
+            total_rows = con.execute(copy_query, [page_files]).fetchone()[0]
+        print(f"Saved {total_rows} population records as Parquet to {dest_file}.")
+        return total_rows
     except Exception as e:
         print(f"Error saving population data to Parquet: {e}")
-
-
-def sync_to_r2(local_path, r2_bucket):
-    print(
-        f"Checking if {os.path.basename(local_path)} is new by comparing with {r2_bucket}...")
-    check_cmd = ["rclone", "check", local_path, r2_bucket]
-    result = subprocess.run(check_cmd, capture_output=True, text=True)
-    if result.returncode == 0:
-        print(f"{os.path.basename(local_path)} has not changed on {r2_bucket}.")
-        return False
-    else:
-        print(
-            f"New data detected for {os.path.basename(local_path)}. Syncing to {r2_bucket}...")
-        copy_cmd = ["rclone", "copy", local_path, r2_bucket, "--checksum"]
-        subprocess.run(copy_cmd, check=True)
-        return True
+        return 0
 
 
 def main():
@@ -124,10 +117,11 @@ def main():
     print(f"Temporary directory: {temp_dir}")
 
     try:
-        pop_list = fetch_population_data()
-        if pop_list:
-            dest_file = os.path.join(temp_dir, "population_data.parquet")
-            save_population_parquet(pop_list, dest_file)
+        pages_dir = os.path.join(temp_dir, "pages")
+        os.makedirs(pages_dir)
+        page_files = fetch_population_data(pages_dir)
+        dest_file = os.path.join(temp_dir, "population_data.parquet")
+        if page_files and save_population_parquet(page_files, dest_file):
             # Sync the generated Parquet file to the "sources" directory in R2.
             sync_to_r2(dest_file, f"{R2_BUCKET_POP}/sources")
         else:
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 # filepath: /workspaces/dbt-duckdb/download_wdi.py
 import os
+import csv
 import subprocess
 import tempfile
 import zipfile
 import argparse
-import pandas as pd
 import shutil
 import concurrent.futures
+import pyarrow as pa
+from pyarrow import csv as pac
+import pyarrow.parquet as pq
+from pipeline_common import PARQUET_ZSTD_LEVEL
+from r2_sync import sync_to_r2
 
 # Constants for downloading WDI data
 SOURCE = "https://databank.worldbank.org/data/download/WDI_CSV.zip"
@@ -16,6 +21,20 @@ SOURCE = "https://databank.worldbank.org/data/download/WDI_CSV.zip"
 # Parquet files are saved in the "sources" folder, while the raw ZIP is saved in the "raw" folder.
 R2_BUCKET_WDI = "r2:wdi"
 
+# Rows are streamed in blocks of this size.
+CSV_BLOCK_SIZE = 64 << 20
+
+# Arrow infers the remaining column types from the first block only, so pin
+# the WDI name/code columns and the year columns, which can be empty or
+# integral for millions of rows before their first decimal value.
+WDI_STRING_COLUMN_PREFIXES = ("Country", "Indicator")
+
+# Parquet data page size for the converted WDI files.
+PARQUET_DATA_PAGE_SIZE = 1 << 20
+
+# Concurrent R2 uploads while conversions are still running.
+UPLOAD_WORKERS = 4
+
 
 def download_file(url, dest_dir):
     print(f"Downloading WDI data from {url} using rclone...")
@@ -34,70 +53,99 @@ def download_file(url, dest_dir):
     return os.path.join(dest_dir, filename)
 
 
-def sync_to_r2(local_path, r2_bucket):
-    print(
-        f"Checking if {os.path.basename(local_path)} is new by comparing with {r2_bucket}...")
-    check_cmd = ["rclone", "check", local_path, r2_bucket]
-    result = subprocess.run(check_cmd, capture_output=True, text=True)
-    if result.returncode == 0:
-        print(f"{os.path.basename(local_path)} has not changed on {r2_bucket}.")
-        return False
+def read_csv_header(csv_source):
+    if hasattr(csv_source, "readline"):
+        header = csv_source.readline()
+        csv_source.seek(0)
     else:
-        print(
-            f"New data detected for {os.path.basename(local_path)}. Syncing to {r2_bucket}...")
-        copy_cmd = ["rclone", "copy", local_path, r2_bucket, "--checksum"]
-        subprocess.run(copy_cmd, check=True)
-        return True
+        with open(csv_source, "rb") as f:
+            header = f.readline()
+    return next(csv.reader([header.decode("utf-8-sig")]))
 
 
-def sync_directory_to_r2(local_dir, r2_bucket, include_pattern=None):
-    print(f"Syncing files from {local_dir} to {r2_bucket}...")
-    cmd = ["rclone", "copy", local_dir, r2_bucket, "--checksum"]
-    if include_pattern:
-        cmd.extend(["--include", include_pattern])
-
-    subprocess.run(cmd, check=True)
-    print(f"Synced {local_dir} to {r2_bucket}.")
-
-
-def unzip_file(zip_path, dest_dir):
-    print("Unzipping file...")
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(dest_dir)
-    print("Unzipped files:")
-    for file in os.listdir(dest_dir):
-        print(f" - {file}")
+def wdi_column_types(column_names):
+    column_types = {}
+    for name in column_names:
+        if name.isdigit():
+            column_types[name] = pa.float64()
+        elif name.startswith(WDI_STRING_COLUMN_PREFIXES):
+            column_types[name] = pa.string()
+    return column_types
 
 
-def convert_csv_to_parquet(csv_path, parquet_path):
-    print(f"Converting {csv_path} to Parquet file {parquet_path} ...")
+def convert_csv_to_parquet(csv_source, parquet_path):
+    # csv_source may be a path or an open file object (e.g. a ZIP member)
+    csv_name = getattr(csv_source, "name", csv_source)
+    print(f"Converting {csv_name} to Parquet file {parquet_path} ...")
     try:
-        df = pd.read_csv(csv_path)
-        df.to_parquet(parquet_path, engine="pyarrow", index=False)
-        print(f"Converted {csv_path} to {parquet_path}.")
+        column_types = wdi_column_types(read_csv_header(csv_source))
+        # Stream record batches into the Parquet writer rather than loading the whole CSV.
+        reader = pac.open_csv(
+            csv_source,
+            read_options=pac.ReadOptions(block_size=CSV_BLOCK_SIZE, use_threads=True),
+            convert_options=pac.ConvertOptions(
+                column_types=column_types, strings_can_be_null=True),
+        )
+        # WDI rows end with a trailing comma; name the resulting blank column the
+        # way pandas did so it stays a valid identifier downstream.
+        schema = pa.schema([
+            field.with_name(field.name or f"Unnamed: {i}")
+            for i, field in enumerate(reader.schema)
+        ])
+        with pq.ParquetWriter(parquet_path, schema, compression="zstd",
+                              compression_level=PARQUET_ZSTD_LEVEL,
+                              use_dictionary=True,
+                              data_page_size=PARQUET_DATA_PAGE_SIZE,
+                              write_statistics=True) as writer:
+            for batch in reader:
+                writer.write_batch(pa.RecordBatch.from_arrays(batch.columns, schema=schema))
+        print(f"Converted {csv_name} to {parquet_path}.")
+        return parquet_path
     except Exception as e:
-        print(f"Error converting {csv_path} to Parquet: {e}")
-
-
-def process_wdi_data(raw_zip, work_dir):
-    unzip_file(raw_zip, work_dir)
-
-    # Collect all CSV files to be processed
-    csv_files = [f for f in os.listdir(work_dir) if f.endswith(".csv")]
+        print(f"Error converting {csv_name} to Parquet: {e}")
+        raise
 
-    # Use ProcessPoolExecutor to parallelize the conversion
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        futures = []
-        for file in csv_files:
-            csv_path = os.path.join(work_dir, file)
-            parquet_filename = os.path.splitext(file)[0] + ".parquet"
-            parquet_path = os.path.join(work_dir, parquet_filename)
-            futures.append(executor.submit(
-                convert_csv_to_parquet, csv_path, parquet_path))
 
-        # Wait for all tasks to complete
+def convert_zip_member_to_parquet(zip_path, member, parquet_path):
+    # Read the CSV straight out of the archive so it is never extracted to disk.
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        with zip_ref.open(member) as csv_file:
+            return convert_csv_to_parquet(csv_file, parquet_path)
+
+
+def process_wdi_data(raw_zip, work_dir, r2_bucket=None):
+    with zipfile.ZipFile(raw_zip, 'r') as zip_ref:
+        # Largest files first so the big WDICSV conversion isn't left until last
+        csv_members = [
+            info.filename for info in sorted(
+                zip_ref.infolist(), key=lambda info: info.file_size, reverse=True)
+            if info.filename.endswith(".csv")
+        ]
+    print("CSV files in archive:")
+    for member in csv_members:
+        print(f" - {member}")
+    if not csv_members:
+        return
+
+    tasks = []
+    for member in csv_members:
+        parquet_filename = os.path.splitext(os.path.basename(member))[0] + ".parquet"
+        tasks.append((raw_zip, member, os.path.join(work_dir, parquet_filename)))
+
+    # Each file converts independently, so run one worker per file up to the core count
+    max_workers = min(len(tasks), os.cpu_count() or 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as upload_executor, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(convert_zip_member_to_parquet, *task) for task in tasks]
+        uploads = []
+        # Upload each Parquet file as soon as it is written, while the
+        # remaining conversions are still running.
         for future in concurrent.futures.as_completed(futures):
-            future.result()
+            parquet_path = future.result()
+            if r2_bucket:
+                uploads.append(upload_executor.submit(sync_to_r2, parquet_path, r2_bucket))
+        for upload in uploads:
+            upload.result()
 
 
 def main():
@@ -110,13 +158,13 @@ def main():
     print(f"Temporary directory: {temp_dir}")
     try:
         raw_zip = download_file(SOURCE, temp_dir)
-        # Sync the raw ZIP to the "raw" folder within the R2 bucket
-        sync_to_r2(raw_zip, f"{R2_BUCKET_WDI}/raw")
-        process_wdi_data(raw_zip, temp_dir)
-
-        # Sync the parquet files to the "sources" folder in the R2 bucket
-        sync_directory_to_r2(
-            temp_dir, f"{R2_BUCKET_WDI}/sources", include_pattern="*.parquet")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as raw_executor:
+            # Sync the raw ZIP to the "raw" folder within the R2 bucket in the
+            # background while the CSVs are converted.
+            raw_upload = raw_executor.submit(sync_to_r2, raw_zip, f"{R2_BUCKET_WDI}/raw")
+            # Convert and sync the parquet files to the "sources" folder in the R2 bucket
+            process_wdi_data(raw_zip, temp_dir, f"{R2_BUCKET_WDI}/sources")
+            raw_upload.result()
     finally:
         print("Cleaning up temporary files...")
         shutil.rmtree(temp_dir)
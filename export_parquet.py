@@ -4,13 +4,65 @@ import os
 import duckdb
 import json
 import argparse
+import concurrent.futures
+
+# Upper bound on mart tables exported concurrently.
+MAX_EXPORT_WORKERS = 8
+
+# DuckDB threads shared by all concurrent exports. Many threads writing into a
+# single Parquet file contend on it, so beyond a few threads more hurt.
+PARQUET_EXPORT_THREADS = min(4, os.cpu_count() or 1)
+
+# Parquet footer key holding an order-independent hash of the table's rows,
+# so sync_remote_parquet can spot unchanged data from the footers alone.
+CONTENT_HASH_KEY = "content_hash"
+
+# Rows per Parquet row group (DuckDB's default, stated so files stay stable).
+PARQUET_ROW_GROUP_SIZE = 122880
+
+
+def export_table_parquet(duck_conn, table_name: str, columns: list, parquet_filename: str) -> str:
+    # Each export runs on its own cursor (a separate connection to the same
+    # database) so DuckDB can execute several COPYs concurrently.
+    cursor = duck_conn.cursor()
+    staging_filename = f"{parquet_filename}.staging"
+    try:
+        # No ORDER BY, so the COPY stays parallel. The marts are views with
+        # DISTINCT and GROUP BY whose row order is not stable between runs,
+        # so an unchanged mart can still write different bytes. Unchanged
+        # data is recognised from the order-independent content hash instead
+        # (sync_remote_parquet's manifest and parquet_files_differ).
+        select_list = ", ".join(columns)
+        # The marts are views, so the view runs once, streaming into a staging
+        # file. The hash and the final file (which carries the hash in its
+        # footer) are then read from that file rather than the view.
+        cursor.execute(
+            f"COPY (SELECT {select_list} FROM main.{table_name}) "
+            f"TO '{staging_filename}' (FORMAT 'parquet', COMPRESSION 'uncompressed')")
+        content_hash = cursor.execute(
+            f"SELECT count(*) || ':' || coalesce(sum(hash({select_list})), 0) FROM read_parquet(?)",
+            [staging_filename]).fetchone()[0]
+        copy_query = (
+            f"COPY (SELECT * FROM read_parquet('{staging_filename}')) "
+            f"TO '{parquet_filename}' (FORMAT 'parquet', COMPRESSION 'zstd', "
+            f"ROW_GROUP_SIZE {PARQUET_ROW_GROUP_SIZE}, "
+            f"KV_METADATA {{{CONTENT_HASH_KEY}: '{content_hash}'}})"
+        )
+        cursor.execute(copy_query)
+    finally:
+        cursor.close()
+        if os.path.exists(staging_filename):
+            os.remove(staging_filename)
+    print(f"Exported table {table_name} to {parquet_filename}")
+    return parquet_filename
 
 
 def export_mart_tables_parquet(duckdb_filename: str, output_dir: str) -> list:
     duck_conn = duckdb.connect(duckdb_filename, read_only=True)
+    # Applies to the whole database instance, so every export cursor shares it
+    duck_conn.execute(f"SET threads = {PARQUET_EXPORT_THREADS}")
     tables = duck_conn.execute("SHOW TABLES;").fetchall()
     mart_prefixes = ("fct_", "dim_", "agg_")
-    exported_files = []
     print("Exporting marts tables from DuckDB to local Parquet files:")
 
     # Fetch all column metadata in a single query
@@ -23,6 +75,7 @@ def export_mart_tables_parquet(duckdb_filename: str, output_dir: str) -> list:
             table_columns[table_name] = []
         table_columns[table_name].append(column_name)
 
+    export_jobs = []
     for row in tables:
         table_name = row[0]
         if table_name.startswith(mart_prefixes):
@@ -33,19 +86,23 @@ def export_mart_tables_parquet(duckdb_filename: str, output_dir: str) -> list:
             if not cols_info:
                 print(f"Warning: Could not retrieve columns for {table_name}")
                 continue
-
-            order_by = ", ".join(cols_info)
-            select_list = ", ".join(cols_info)
-            copy_query = (
-                f"COPY (SELECT {select_list} FROM main.{table_name} ORDER BY {order_by}) "
-                f"TO '{parquet_filename}' (FORMAT 'parquet')"
-            )
-            duck_conn.execute(copy_query)
-            print(f"Exported table {table_name} to {parquet_filename}")
-            exported_files.append(parquet_filename)
+            export_jobs.append((table_name, cols_info, parquet_filename))
         else:
             print(f"Skipping non-mart table: {table_name}")
-    duck_conn.close()
+
+    exported_files = []
+    try:
+        if export_jobs:
+            max_workers = min(MAX_EXPORT_WORKERS, len(export_jobs))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(export_table_parquet, duck_conn, *job)
+                    for job in export_jobs
+                ]
+                # Collect in table order so exported_files.json stays stable
+                exported_files = [future.result() for future in futures]
+    finally:
+        duck_conn.close()
     return exported_files
 
 
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# filepath: /workspaces/dbt-duckdb/pipeline_common.py
+# Helpers and settings shared by the pipeline scripts.
+import os
+
+# ZSTD level for the Parquet source files uploaded to R2. They are written
+# once and read on every pipeline run, so the slower, smaller level pays off.
+PARQUET_ZSTD_LEVEL = 9
+
+# rclone defaults to 4 transfers and 8 checkers; the mart tables are many
+# small files, so let a single rclone call move and check them in parallel.
+# Both default to 32 here; set RCLONE_TRANSFERS / RCLONE_CHECKERS to change
+# them. --fast-list lists the bucket in one recursive call instead of one per
+# directory; calls that pass --files-from-raw skip the listing anyway.
+RCLONE_PARALLEL_FLAGS = [
+    f"--transfers={os.environ.get('RCLONE_TRANSFERS', '32')}",
+    f"--checkers={os.environ.get('RCLONE_CHECKERS', '32')}",
+    "--fast-list",
+]
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
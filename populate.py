@@ -1,21 +1,21 @@
 #!/usr/bin/env python3
 # filepath: /workspaces/dbt-duckdb/populate.py
 import os
-import io
 import shutil
 import tempfile
 import subprocess
 import duckdb
 import argparse
-import pandas as pd
-import pyarrow.parquet as pq
 import concurrent.futures
-from sqlalchemy import create_engine, text
+from r2_sync import R2_ENDPOINT_URL
+from pipeline_common import RCLONE_PARALLEL_FLAGS, quote_identifier
 
 # Constants for processing
 # These will be the local mirror copies from the R2 bucket.
 # Contains Parquet files for each table of WDI data
 R2_BUCKET_WDI = "r2:wdi"
+# The same "sources" folder as seen by DuckDB's httpfs S3 reader.
+R2_SOURCES_URL = "s3://wdi/sources"
 
 POSTGRES_DB = "wdi"
 POSTGRES_USER = "postgres"
@@ -23,6 +23,13 @@ POSTGRES_PASSWORD = "postgres"
 POSTGRES_HOST = "localhost"
 POSTGRES_PORT = 5432
 DUCKDB_DATABASE = f"{POSTGRES_DB}.duckdb"
+POSTGRES_CONNECTION = (
+    f"dbname={POSTGRES_DB} user={POSTGRES_USER} password={POSTGRES_PASSWORD} "
+    f"host={POSTGRES_HOST} port={POSTGRES_PORT}"
+)
+
+# Parquet sources loaded into DuckDB at the same time.
+POPULATE_WORKERS = 4
 
 
 def process_parquet_duckdb(parquet_path, table_name, con):
@@ -33,12 +40,16 @@ def process_parquet_duckdb(parquet_path, table_name, con):
     CREATE TABLE IF NOT EXISTS main.{table_name} AS
     SELECT * FROM read_parquet('{parquet_path}');
     """
-    res = con.execute(query).fetchone()
-    if res is not None:
-        count = res[0]
-    else:
-        count = con.execute(
-            f"SELECT COUNT(*) FROM main.{table_name}").fetchone()[0]
+    cursor = con.cursor()
+    try:
+        res = cursor.execute(query).fetchone()
+        if res is not None:
+            count = res[0]
+        else:
+            count = cursor.execute(
+                f"SELECT COUNT(*) FROM main.{table_name}").fetchone()[0]
+    finally:
+        cursor.close()
     if count == 0:
         print(f"Error: No data loaded into main.{table_name}.")
     else:
@@ -46,54 +57,82 @@ def process_parquet_duckdb(parquet_path, table_name, con):
             f"Table main.{table_name} loaded with {count} rows from {parquet_path}.")
 
 
-def process_parquet_postgres(parquet_path, table_name, engine):
+def drop_postgres_tables(con, table_names):
+    # Run by Postgres itself so CASCADE also drops the dbt views built on the
+    # tables, then clear DuckDB's cached view of the Postgres catalog. Names
+    # are quoted: the sources are mixed case (WDICSV) and were created so.
+    drop_sql = " ".join(
+        f"DROP TABLE IF EXISTS public.{quote_identifier(table_name)} CASCADE;" for table_name in table_names)
+    con.execute("CALL postgres_execute('pg', ?)", [drop_sql])
+    con.execute("CALL pg_clear_cache()")
+
+
+def process_parquet_postgres(parquet_path, table_name, con):
     print(
         f"Processing table {table_name} in PostgreSQL from file {parquet_path}...")
+    # DuckDB reads the Parquet file and streams it into Postgres with binary
+    # COPY, so no rows pass through pandas. Each table gets its own cursor so
+    # several loads can run at once.
+    cursor = con.cursor()
     try:
-        # Use a connection (with engine.begin()) to drop the table with CASCADE.
-        with engine.begin() as conn:
-            conn.execute(
-                text(f"DROP TABLE IF EXISTS public.{table_name} CASCADE"))
-
-        pf = pq.ParquetFile(parquet_path)
-        # Write the new table to the database with if_exists="replace" using an empty dataframe for schema
-        df_schema = pf.schema_arrow.empty_table().to_pandas()
-        df_schema.to_sql(table_name, engine, schema="public",
-                          if_exists="replace", index=False)
-
-        total_rows = 0
-        # Write data using COPY
-        raw_conn = engine.raw_connection()
-        try:
-            with raw_conn.cursor() as cur:
-                for batch in pf.iter_batches(batch_size=100000):
-                    df_batch = batch.to_pandas()
-                    total_rows += len(df_batch)
-                    output = io.StringIO()
-                    df_batch.to_csv(output, sep=',', index=False, header=False, na_rep='__NULL__')
-                    output.seek(0)
-                    cur.copy_expert(f"COPY public.{table_name} FROM STDIN WITH (FORMAT CSV, NULL '__NULL__')", output)
-            raw_conn.commit()
-        finally:
-            raw_conn.close()
+        total_rows = cursor.execute(
+            f"CREATE TABLE pg.public.{quote_identifier(table_name)} AS SELECT * FROM read_parquet(?)",
+            [parquet_path]).fetchone()[0]
         print(
             f"Table {table_name} loaded with {total_rows} rows from {parquet_path}.")
     except Exception as e:
         print(f"Error processing {parquet_path} for table {table_name}: {e}")
+    finally:
+        cursor.close()
+
+
+def create_r2_secret(con):
+    # Same credentials as rclone's env_auth and r2_sync
+    endpoint = R2_ENDPOINT_URL.removeprefix("https://")
+    key_id = os.environ["AWS_ACCESS_KEY_ID"].replace("'", "''")
+    secret = os.environ["AWS_SECRET_ACCESS_KEY"].replace("'", "''")
+    con.execute(f"""
+    CREATE SECRET r2 (
+        TYPE S3, KEY_ID '{key_id}', SECRET '{secret}',
+        ENDPOINT '{endpoint}', REGION 'auto', URL_STYLE 'path'
+    )
+    """)
 
 
-def setup_postgres_engine():
-    from sqlalchemy.engine.url import URL
-    url = URL.create(
-        drivername="postgresql+psycopg2",
-        username=POSTGRES_USER,
-        password=POSTGRES_PASSWORD,
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT,
-        database=POSTGRES_DB
-    )
-    engine = create_engine(url)
-    return engine
+def populate_duckdb_from_r2():
+    # DuckDB reads the Parquet sources straight from R2 over httpfs, so
+    # nothing is staged on local disk first.
+    con = duckdb.connect(DUCKDB_DATABASE)
+    try:
+        create_r2_secret(con)
+        con.execute("CREATE SCHEMA IF NOT EXISTS main")
+        parquet_files = [
+            row[0] for row in con.execute("SELECT file FROM glob(?)", [f"{R2_SOURCES_URL}/*.parquet"]).fetchall()]
+        if not parquet_files:
+            print(f"No Parquet files found in {R2_SOURCES_URL}.")
+            return
+        # Each table loads on its own cursor, so DuckDB runs the
+        # CREATE TABLE statements side by side.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=POPULATE_WORKERS) as executor:
+            futures = []
+            for parquet_path in parquet_files:
+                table_name = os.path.splitext(os.path.basename(parquet_path))[0].replace("-", "")
+                print(
+                    f"Starting DuckDB processing for table: {table_name}")
+                futures.append(executor.submit(
+                    process_parquet_duckdb, parquet_path, table_name, con))
+
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+    finally:
+        con.close()
+    print("DuckDB population complete.")
+
+
+def connect_postgres():
+    con = duckdb.connect()
+    con.execute(f"ATTACH '{POSTGRES_CONNECTION}' AS pg (TYPE POSTGRES)")
+    return con
 
 
 def main():
@@ -111,50 +150,49 @@ def main():
         print("Error: Please specify either --use-duckdb or --use-postgres (but not both).")
         exit(1)
 
+    if args.use_duckdb:
+        populate_duckdb_from_r2()
+        print("Done.")
+        return
+
     temp_dir = tempfile.mkdtemp()
     print(f"Temporary directory created at {temp_dir}")
 
     try:
         # Copy all Parquet files from the R2 "sources" folder.
         subprocess.run(["rclone", "copy", f"{R2_BUCKET_WDI}/sources",
-                        temp_dir, "--checksum"], check=True)
-        parquet_files = [f for f in os.listdir(
-            temp_dir) if f.endswith(".parquet")]
+                        temp_dir, "--checksum", *RCLONE_PARALLEL_FLAGS], check=True)
+        with os.scandir(temp_dir) as entries:
+            parquet_files = [
+                entry.name for entry in entries
+                if entry.is_file() and entry.name.endswith(".parquet")]
         if not parquet_files:
             print("No Parquet files found in local copy.")
         else:
-            if args.use_duckdb:
-                con = duckdb.connect(DUCKDB_DATABASE)
-                con.execute("CREATE SCHEMA IF NOT EXISTS main")
-                try:
-                    for file in parquet_files:
-                        parquet_path = os.path.join(temp_dir, file)
-                        table_name = os.path.splitext(file)[0].replace("-", "")
-                        print(
-                            f"Starting DuckDB processing for table: {table_name}")
-                        process_parquet_duckdb(parquet_path, table_name, con)
-                finally:
-                    con.close()
-                print("DuckDB population complete.")
-            elif args.use_postgres:
-                engine = setup_postgres_engine()
+            con = connect_postgres()
+            try:
+                tables = [
+                    (os.path.join(temp_dir, file), os.path.splitext(file)[0].replace("-", ""))
+                    for file in parquet_files
+                ]
+                drop_postgres_tables(con, [table_name for _, table_name in tables])
                 # Use ThreadPoolExecutor to parallelize PostgreSQL processing
                 # We use 5 workers as a reasonable default for I/O bound tasks
                 with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
                     futures = []
-                    for file in parquet_files:
-                        parquet_path = os.path.join(temp_dir, file)
-                        table_name = os.path.splitext(file)[0].replace("-", "")
+                    for parquet_path, table_name in tables:
                         print(
                             f"Starting PostgreSQL processing for table: {table_name}")
                         futures.append(executor.submit(
-                            process_parquet_postgres, parquet_path, table_name, engine))
+                            process_parquet_postgres, parquet_path, table_name, con))
 
                     # Wait for all tasks to complete and handle exceptions
                     for future in concurrent.futures.as_completed(futures):
                         future.result()
+            finally:
+                con.close()
 
-                print("PostgreSQL population complete.")
+            print("PostgreSQL population complete.")
     finally:
         print("Cleaning up temporary files...")
         shutil.rmtree(temp_dir)
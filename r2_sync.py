@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# filepath: /workspaces/dbt-duckdb/r2_sync.py
+import os
+import base64
+import hashlib
+import mimetypes
+import threading
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+# Same endpoint as the "r2" remote in rclone.conf. Credentials are read from
+# AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY, just as rclone's env_auth does.
+R2_ENDPOINT_URL = os.environ.get(
+    "R2_ENDPOINT_URL",
+    "https://91702b02e6201c5d52ae9956567e6fd9.r2.cloudflarestorage.com")
+
+# Large files (the raw WDI ZIP) are uploaded as parallel multipart uploads.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=64 * 1024 * 1024, max_concurrency=8)
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            _s3_client = boto3.client(
+                "s3", endpoint_url=R2_ENDPOINT_URL, region_name="auto")
+        return _s3_client
+
+
+def split_remote_path(remote_path):
+    # "r2:wdi/sources" -> ("wdi", "sources")
+    path = remote_path.split(":", 1)[-1]
+    bucket, _, prefix = path.partition("/")
+    return bucket, prefix.strip("/")
+
+
+def compute_md5(local_path):
+    with open(local_path, "rb") as f:
+        return hashlib.file_digest(f, "md5").hexdigest()
+
+
+def get_remote_md5(client, bucket, key):
+    try:
+        head = client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    # The ETag is only a plain MD5 for single-part uploads; multipart uploads
+    # carry it in the md5chksum metadata (base64), as rclone writes it.
+    md5chksum = head.get("Metadata", {}).get("md5chksum")
+    if md5chksum:
+        return base64.b64decode(md5chksum).hex()
+    etag = head.get("ETag", "").strip('"')
+    return etag if "-" not in etag else None
+
+
+def sync_to_r2(local_path, r2_bucket):
+    filename = os.path.basename(local_path)
+    print(f"Checking if {filename} is new by comparing with {r2_bucket}...")
+    bucket, prefix = split_remote_path(r2_bucket)
+    key = f"{prefix}/{filename}" if prefix else filename
+
+    local_md5 = compute_md5(local_path)
+    client = get_s3_client()
+    if get_remote_md5(client, bucket, key) == local_md5:
+        print(f"{filename} has not changed on {r2_bucket}.")
+        return False
+
+    print(f"New data detected for {filename}. Syncing to {r2_bucket}...")
+    client.upload_file(
+        local_path, bucket, key,
+        ExtraArgs={
+            "ContentType": mimetypes.guess_type(local_path)[0] or "application/octet-stream",
+            "Metadata": {"md5chksum": base64.b64encode(bytes.fromhex(local_md5)).decode()},
+        },
+        Config=TRANSFER_CONFIG,
+    )
+    return True
+
@@ -5,15 +5,142 @@ import sys
 import subprocess
 import tempfile
 import json
+import hashlib
 import concurrent.futures
-import pandas as pd
+import contextlib
+import duckdb
+import pyarrow.parquet as pq
 import argparse
+from export_parquet import CONTENT_HASH_KEY
+from pipeline_common import RCLONE_PARALLEL_FLAGS
 
 
-def load_and_sort_parquet_file(filename: str) -> pd.DataFrame:
-    df = pd.read_parquet(filename, engine="pyarrow")
-    sort_cols = df.columns.tolist()
-    return df.sort_values(by=sort_cols).reset_index(drop=True)
+
+# Tolerances for numeric columns, matching the old pandas assert_frame_equal
+# check: |local - remote| <= atol + rtol * |remote|.
+COMPARE_RTOL = 1e-5
+COMPARE_ATOL = 5e-4
+
+# Column types compared with tolerance; everything else must match exactly.
+APPROX_COMPARE_TYPES = ("FLOAT", "DOUBLE", "DECIMAL")
+
+# Fingerprints of the Parquet files last synced, kept next to them on the
+# remote so unchanged files are recognised without checking or downloading.
+MANIFEST_FILENAME = "parquet_manifest.json"
+
+# rclone check exits 0 when every file matches and 1 when differences were
+# found; anything else means the check itself failed.
+RCLONE_CHECK_OK_CODES = (0, 1)
+
+
+def parquet_fingerprint(parquet_file: str):
+    # Built from the footer alone: the content hash written by export_parquet
+    # and the schema. Files exported without a content hash have none.
+    metadata = pq.read_metadata(parquet_file)
+    content_hash = (metadata.metadata or {}).get(CONTENT_HASH_KEY.encode())
+    if not content_hash:
+        return None
+    schema = metadata.schema.to_arrow_schema().remove_metadata().to_string()
+    return hashlib.sha256(content_hash + b"\n" + schema.encode()).hexdigest()
+
+
+def manifest_key(local_file: str, root: str) -> str:
+    # The file's path on the remote, relative to the remote base path.
+    return os.path.relpath(os.path.abspath(local_file), root).replace(os.sep, "/")
+
+
+def build_local_manifest(local_files: list, root: str) -> dict:
+    manifest = {}
+    for local_file in local_files:
+        fingerprint = parquet_fingerprint(local_file)
+        if fingerprint:
+            manifest[manifest_key(local_file, root)] = fingerprint
+    return manifest
+
+
+def load_remote_manifest(remote_base_path: str) -> dict:
+    result = subprocess.run(
+        ["rclone", "cat", f"{remote_base_path}/{MANIFEST_FILENAME}"],
+        capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        # Missing on the first run; every file is then checked as before.
+        return {}
+    try:
+        manifest = json.loads(result.stdout)
+    except ValueError:
+        manifest = None
+    if not isinstance(manifest, dict):
+        print(f"Ignoring unreadable {MANIFEST_FILENAME} on {remote_base_path}.")
+        return {}
+    return manifest
+
+
+def save_remote_manifest(manifest: dict, remote_base_path: str) -> None:
+    subprocess.run(
+        ["rclone", "rcat", f"{remote_base_path}/{MANIFEST_FILENAME}"],
+        input=json.dumps(manifest, sort_keys=True), text=True, check=True)
+
+
+def parquet_files_differ(local_file: str, remote_file: str) -> bool:
+    # Row counts live in the footers, so a changed count is found without
+    # decoding any pages. Min/max statistics are not used: float drift
+    # within tolerance would change them without changing the data.
+    local_metadata = pq.read_metadata(local_file)
+    remote_metadata = pq.read_metadata(remote_file)
+    if local_metadata.num_rows != remote_metadata.num_rows:
+        return True
+    # Files exported with a content hash match when the hashes and schemas
+    # do, whatever order the rows were written in.
+    local_hash = (local_metadata.metadata or {}).get(CONTENT_HASH_KEY.encode())
+    remote_hash = (remote_metadata.metadata or {}).get(CONTENT_HASH_KEY.encode())
+    if local_hash and local_hash == remote_hash and local_metadata.schema.equals(remote_metadata.schema):
+        return False
+
+    # Both files are sorted on every column and compared row by row inside
+    # DuckDB, so the comparison never materialises a DataFrame.
+    with duckdb.connect() as con:
+        local_schema = con.execute("DESCRIBE SELECT * FROM read_parquet(?)", [local_file]).fetchall()
+        remote_schema = con.execute("DESCRIBE SELECT * FROM read_parquet(?)", [remote_file]).fetchall()
+        local_columns = [(row[0], row[1]) for row in local_schema]
+        if local_columns != [(row[0], row[1]) for row in remote_schema]:
+            return True
+
+        columns = []
+        conditions = []
+        for column_name, column_type in local_columns:
+            column = '"' + column_name.replace('"', '""') + '"'
+            columns.append(column)
+            condition = f"l.{column} IS NOT DISTINCT FROM r.{column}"
+            if column_type.startswith(APPROX_COMPARE_TYPES):
+                condition += (
+                    f" OR abs(l.{column} - r.{column}) <= "
+                    f"{COMPARE_ATOL} + {COMPARE_RTOL} * abs(r.{column})")
+            conditions.append(f"({condition})")
+        rows_match = " AND ".join(conditions)
+        order_by = ", ".join(columns)
+
+        diff_query = f"""
+        WITH l AS (SELECT *, row_number() OVER (ORDER BY {order_by}) AS _row FROM read_parquet(?)),
+             r AS (SELECT *, row_number() OVER (ORDER BY {order_by}) AS _row FROM read_parquet(?))
+        SELECT count(*)
+        FROM l FULL OUTER JOIN r ON l._row = r._row
+        WHERE l._row IS NULL OR r._row IS NULL OR NOT ({rows_match})
+        """
+        mismatches = con.execute(diff_query, [local_file, remote_file]).fetchone()[0]
+    return mismatches > 0
+
+
+@contextlib.contextmanager
+def file_list(filenames: list):
+    # One path per line for rclone --files-from-raw, which unlike --files-from
+    # does not treat lines starting with # or ; as comments, so no escaping.
+    # The list is removed along with its directory on exit.
+    with tempfile.TemporaryDirectory() as list_dir:
+        list_path = os.path.join(list_dir, "files.txt")
+        with open(list_path, "w") as f:
+            for filename in filenames:
+                f.write(filename + "\n")
+        yield list_path
 
 
 def compare_file_pair(filename: str, common_dir: str, temp_download_dir: str) -> str:
@@ -21,16 +148,10 @@ def compare_file_pair(filename: str, common_dir: str, temp_download_dir: str) ->
     remote_file = os.path.join(temp_download_dir, filename)
 
     try:
-        local_df = load_and_sort_parquet_file(local_file)
-        remote_df = load_and_sort_parquet_file(remote_file)
-        pd.testing.assert_frame_equal(
-            local_df, remote_df,
-            rtol=1e-5, atol=5e-4, check_exact=False
-        )
+        if parquet_files_differ(local_file, remote_file):
+            print(f"Data mismatch in file: {filename}")
+            return local_file
         return None
-    except AssertionError:
-        print(f"Data mismatch in file: {filename}")
-        return local_file
     except Exception as e:
         print(f"Failed to compare file {filename}: {e}")
         # If comparison fails (e.g. load error), assume changed to be safe?
@@ -38,159 +159,134 @@ def compare_file_pair(filename: str, common_dir: str, temp_download_dir: str) ->
         return local_file
 
 
-def get_changed_files(local_files: list, remote_base_path: str, temp_download_dir: str) -> list:
+def common_root(files: list) -> str:
+    # Directory that maps onto the remote base path. Checks and uploads must
+    # use the same root, or a file is looked for where it was never written.
+    return os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files])
+
+
+def get_changed_files(local_files: list, remote_base_path: str, temp_download_dir: str,
+                      root: str = None) -> list:
+    return classify_files(local_files, remote_base_path, temp_download_dir, root)[0]
+
+
+def classify_files(local_files: list, remote_base_path: str, temp_download_dir: str,
+                   root: str = None, fingerprint_matches: set = frozenset()) -> tuple:
+    """
+    Returns (changed, unchanged): the local files that differ from or are
+    missing on the remote, and those confirmed to match it. Raises if rclone
+    could not check every file.
+
+    fingerprint_matches holds the manifest keys whose fingerprint matches the
+    remote manifest. Those files still need to exist on the remote, but when
+    rclone sees different bytes they count as unchanged without a download.
+    """
     if not local_files:
-        return []
+        return [], []
 
-    # Identify common directory for local files
-    # We assume all exported files are in the same directory (as per export_parquet.py)
-    common_dir = os.path.dirname(local_files[0])
-    if not common_dir:
-        common_dir = "."
+    # export_parquet.py writes every file to one directory, but relative paths
+    # stay valid even if it doesn't.
+    common_dir = root or common_root(local_files)
 
     # Create a list of files relative to common_dir
     relative_files = []
     for f in local_files:
-        rel = os.path.relpath(f, common_dir)
+        rel = os.path.relpath(os.path.abspath(f), common_dir)
         relative_files.append(rel)
 
     changed = []
-    temp_list_path = None
-    try:
-        # Create a temporary file list for rclone --files-from
-        with tempfile.NamedTemporaryFile(mode="w", delete=False) as tf:
-            for f in relative_files:
-                # Escape backslashes first
-                f_esc = f.replace("\\", "\\\\")
-                # Escape filenames starting with # or ;
-                if f_esc.startswith("#") or f_esc.startswith(";"):
-                    f_esc = "\\" + f_esc
-                tf.write(f_esc + "\n")
-            temp_list_path = tf.name
-
-        print(f"Checking for changes between {common_dir} and {remote_base_path}...")
-        # Run rclone check
+    unchanged = []
+    print(f"Checking for changes between {common_dir} and {remote_base_path}...")
+    with file_list(relative_files) as list_path:
         cmd = [
             "rclone", "check", common_dir, remote_base_path,
-            "--files-from", temp_list_path,
-            "--combined", "-"
+            "--files-from-raw", list_path,
+            "--combined", "-",
+            *RCLONE_PARALLEL_FLAGS
         ]
 
         # rclone check returns exit code 1 if differences found, so check=False
         result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+    if result.returncode not in RCLONE_CHECK_OK_CODES:
+        raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout, result.stderr)
+
+    files_to_download = []
+    reported = set()
+
+    for line in result.stdout.splitlines():
+        if not line:
+            continue
+        # Output format: status path (separated by space)
+        # But path can contain spaces. rclone check --combined output is fixed width?
+        # No, it's `X path`.
+        parts = line.split(" ", 1)
+        if len(parts) < 2:
+            continue
+        status = parts[0]
+        filename = parts[1].strip()
+        reported.add(filename)
+
+        if status == "=":
+            unchanged.append(os.path.join(common_dir, filename))
+        elif status == "*" and filename in fingerprint_matches:
+            unchanged.append(os.path.join(common_dir, filename))
+        elif status == "*" or status == "!":
+            # Changed or Error: need to verify with fuzzy comparison
+            files_to_download.append(filename)
+        elif status == "+":
+            # Missing on remote (remote is dest). So it's a new file.
+            print(f"New file detected: {filename}")
+            changed.append(os.path.join(common_dir, filename))
+        # '-' means missing on local, which shouldn't happen as we limit checks to local files
+
+    unreported = [f for f in relative_files if f not in reported]
+    if unreported:
+        raise RuntimeError(f"rclone check reported no status for: {', '.join(unreported)}")
+
+    if files_to_download:
+        print(f"Downloading {len(files_to_download)} potentially changed files for inspection...")
+        with file_list(files_to_download) as list_path:
+            subprocess.run(
+                ["rclone", "copy", remote_base_path, temp_download_dir, "--files-from-raw", list_path,
+                 *RCLONE_PARALLEL_FLAGS],
+                check=True
+            )
 
-        files_to_download = []
-
-        for line in result.stdout.splitlines():
-            if not line:
-                continue
-            # Output format: status path (separated by space)
-            # But path can contain spaces. rclone check --combined output is fixed width?
-            # No, it's `X path`.
-            parts = line.split(" ", 1)
-            if len(parts) < 2:
-                continue
-            status = parts[0]
-            filename = parts[1].strip()
-
-            if status == "=":
-                continue
-            elif status == "*" or status == "!":
-                # Changed or Error: need to verify with fuzzy comparison
-                files_to_download.append(filename)
-            elif status == "+":
-                # Missing on remote (remote is dest). So it's a new file.
-                print(f"New file detected: {filename}")
-                changed.append(os.path.join(common_dir, filename))
-            # '-' means missing on local, which shouldn't happen as we limit checks to local files
-
-        if files_to_download:
-            print(f"Downloading {len(files_to_download)} potentially changed files for inspection...")
-            # Create download list
-            dl_list_path = None
-            try:
-                with tempfile.NamedTemporaryFile(mode="w", delete=False) as dl_tf:
-                    for f in files_to_download:
-                        f_esc = f.replace("\\", "\\\\")
-                        if f_esc.startswith("#") or f_esc.startswith(";"):
-                            f_esc = "\\" + f_esc
-                        dl_tf.write(f_esc + "\n")
-                    dl_list_path = dl_tf.name
-
-                subprocess.run(
-                    ["rclone", "copy", remote_base_path, temp_download_dir, "--files-from", dl_list_path],
-                    check=True
-                )
-            finally:
-                if dl_list_path and os.path.exists(dl_list_path):
-                    os.remove(dl_list_path)
-
-            # Compare downloaded files with local files
-            with concurrent.futures.ProcessPoolExecutor() as executor:
-                futures = {
-                    executor.submit(compare_file_pair, filename, common_dir, temp_download_dir): filename
-                    for filename in files_to_download
-                }
-                for future in concurrent.futures.as_completed(futures):
-                    result = future.result()
-                    if result:
-                        changed.append(result)
-
-    finally:
-        if temp_list_path and os.path.exists(temp_list_path):
-            os.remove(temp_list_path)
-
-    return changed
-
-
-def _sync_dir(dirname: str, filenames: list, remote_path: str) -> None:
-    print(f"Syncing {len(filenames)} files from {dirname} to {remote_path}...")
-    temp_list_path = None
-    try:
-        # Create a temporary file list for --files-from
-        with tempfile.NamedTemporaryFile(mode="w", delete=False) as tf:
-            for filename in filenames:
-                # Escape backslashes first, as they are the escape character
-                filename_esc = filename.replace("\\", "\\\\")
-                # Escape filenames starting with # or ; as rclone treats them as comments
-                if filename_esc.startswith("#") or filename_esc.startswith(";"):
-                    filename_esc = "\\" + filename_esc
-                tf.write(filename_esc + "\n")
-            temp_list_path = tf.name
-
+        # Compare downloaded files with local files. DuckDB releases the
+        # GIL while it scans, so threads overlap without forking workers.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = {
+                executor.submit(compare_file_pair, filename, common_dir, temp_download_dir): filename
+                for filename in files_to_download
+            }
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                if result:
+                    changed.append(result)
+                else:
+                    unchanged.append(os.path.join(common_dir, futures[future]))
+
+    return changed, unchanged
+
+
+def sync_local_to_remote(files: list, remote_path: str = "r2:wdi", root: str = None) -> None:
+    # A single rclone call from the common parent directory lets rclone
+    # schedule every transfer together instead of once per directory.
+    root = root or common_root(files)
+    relative_files = [os.path.relpath(os.path.abspath(f), root) for f in files]
+    print(f"Syncing {len(files)} files from {root} to {remote_path}...")
+    with file_list(relative_files) as list_path:
         try:
             subprocess.run(
-                ["rclone", "copy", dirname, remote_path, "--files-from", temp_list_path],
+                ["rclone", "copy", root, remote_path, "--files-from-raw", list_path,
+                 *RCLONE_PARALLEL_FLAGS],
                 check=True,
                 capture_output=True,
                 text=True
             )
         except subprocess.CalledProcessError as e:
-            print(f"rclone copy failed for {dirname}: {e.stderr}", file=sys.stderr)
+            print(f"rclone copy failed for {root}: {e.stderr}", file=sys.stderr)
             raise
-    finally:
-        if temp_list_path and os.path.exists(temp_list_path):
-            os.remove(temp_list_path)
-
-def sync_local_to_remote(files: list, remote_path: str = "r2:wdi") -> None:
-    # Group files by directory to batch rclone calls
-    files_by_dir = {}
-    for local_file in files:
-        dirname, filename = os.path.split(local_file)
-        # If path is just a filename, dirname is empty string, convert to current dir
-        if not dirname:
-            dirname = "."
-        if dirname not in files_by_dir:
-            files_by_dir[dirname] = []
-        files_by_dir[dirname].append(filename)
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(_sync_dir, dirname, filenames, remote_path)
-            for dirname, filenames in files_by_dir.items()
-        ]
-        for future in concurrent.futures.as_completed(futures):
-            future.result()
 
 
 def main():
@@ -216,14 +312,32 @@ def main():
     with open(args.input_json, "r", encoding="utf-8") as f:
         exported_files = json.load(f)
 
+    # Taken over all exported files, so the changed subset is checked and
+    # uploaded at the same paths on the remote.
+    root = common_root(exported_files) if exported_files else os.getcwd()
+
+    # Files whose fingerprint matches the remote manifest need no download,
+    # but are still checked so one missing from the remote is uploaded again.
+    remote_manifest = load_remote_manifest(args.remote_path)
+    local_manifest = build_local_manifest(exported_files, root)
+    fingerprint_matches = {
+        key for key, fingerprint in local_manifest.items()
+        if remote_manifest.get(key) == fingerprint
+    }
+    print(f"{len(fingerprint_matches)} files unchanged according to {MANIFEST_FILENAME}.")
+
     with tempfile.TemporaryDirectory() as remote_dir:
         # We pass remote_dir as the temp dir for downloads
-        changed_files = get_changed_files(exported_files, args.remote_path, remote_dir)
+        changed_files, matching_files = classify_files(
+            exported_files, args.remote_path, remote_dir, root, fingerprint_matches)
+        # Only files known to be on the remote get their fingerprint recorded.
+        confirmed_files = list(matching_files)
         if changed_files:
             if args.no_updates:
                 print("No-updates mode enabled: skipping syncing to remote.")
             else:
-                sync_local_to_remote(changed_files, args.remote_path)
+                sync_local_to_remote(changed_files, args.remote_path, root)
+                confirmed_files.extend(changed_files)
             # Remove the .parquet extension from the filenames
             changed_tables = [os.path.splitext(os.path.basename(f))[
                 0] for f in changed_files]
@@ -234,6 +348,14 @@ def main():
             changed_tables = []
             print("No changes detected in Parquet files.")
 
+    confirmed_keys = {manifest_key(f, root) for f in confirmed_files}
+    updated_manifest = {
+        **remote_manifest,
+        **{key: fingerprint for key, fingerprint in local_manifest.items() if key in confirmed_keys},
+    }
+    if not args.no_updates and updated_manifest != remote_manifest:
+        save_remote_manifest(updated_manifest, args.remote_path)
+
     with open(args.output_json, "w", encoding="utf-8") as out_file:
         json.dump(changed_tables, out_file)
     print(f"JSON of changed tables written to {args.output_json}")
@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import patch
+import asyncio
+import os
+import tempfile
+import sys
+import orjson
+import pyarrow.parquet as pq
+
+# Add current directory to path to import script
+sys.path.append(os.getcwd())
+import download_population
+
+
+def page_body(page, pages, records):
+    return orjson.dumps([{"page": page, "pages": pages}, records])
+
+
+class TestDownloadPopulation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pages_dir = os.path.join(self.tmp_dir.name, "pages")
+        os.makedirs(self.pages_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_page(self, page, pages, records):
+        path = download_population.page_filename(self.pages_dir, page)
+        with open(path, "wb") as f:
+            f.write(page_body(page, pages, records))
+        return path
+
+    def test_save_population_parquet_skips_missing_codes(self):
+        page_files = [
+            self.write_page(1, 2, [
+                {"indicator": {"id": "SP.POP.TOTL"}, "countryiso3code": "USA", "value": 333287557},
+                {"indicator": {"id": "SP.POP.TOTL"}, "countryiso3code": None, "value": 1},
+            ]),
+            self.write_page(2, 2, [
+                {"indicator": {"id": "SP.POP.TOTL"}, "countryiso3code": "", "value": None},
+            ]),
+        ]
+        dest_file = os.path.join(self.tmp_dir.name, "population_data.parquet")
+
+        total_rows = download_population.save_population_parquet(page_files, dest_file)
+
+        self.assertEqual(total_rows, 2)
+        table = pq.read_table(dest_file)
+        self.assertEqual(table.column_names, ["country_code", "population"])
+        self.assertEqual(table.column("country_code").to_pylist(), ["USA", ""])
+        self.assertEqual(table.column("population").to_pylist(), [333287557.0, None])
+
+    def test_fetch_population_data_collects_all_pages(self):
+        total_pages = 6
+
+        async def fake_fetch_bytes(client, url):
+            page = int(url.split("&page=")[1].split("&")[0])
+            await asyncio.sleep(0)
+            if page > total_pages:
+                return orjson.dumps([{"page": page, "pages": total_pages}, None])
+            return page_body(page, total_pages, [{"countryiso3code": f"C{page}", "value": page}])
+
+        with patch('download_population.fetch_bytes', side_effect=fake_fetch_bytes):
+            page_files = download_population.fetch_population_data(self.pages_dir)
+
+        self.assertEqual(page_files, [
+            download_population.page_filename(self.pages_dir, p)
+            for p in range(1, total_pages + 1)
+        ])
+
+        dest_file = os.path.join(self.tmp_dir.name, "population_data.parquet")
+        download_population.save_population_parquet(page_files, dest_file)
+        self.assertEqual(pq.read_table(dest_file).column("country_code").to_pylist(),
+                         [f"C{p}" for p in range(1, total_pages + 1)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import tempfile
+import zipfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Add current directory to path to import script
+sys.path.append(os.getcwd())
+import download_wdi
+
+
+class TestConvertCsvToParquet(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.zip_path = os.path.join(self.tmp_dir.name, "WDI_CSV.zip")
+        self.parquet_path = os.path.join(self.tmp_dir.name, "WDICSV.parquet")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_zip(self, rows):
+        lines = ['\ufeff"Country Name","Country Code","Indicator Name","Indicator Code","1960","1961",']
+        lines += rows
+        with zipfile.ZipFile(self.zip_path, "w") as zip_file:
+            zip_file.writestr("WDICSV.csv", "\n".join(lines) + "\n")
+
+    @patch('download_wdi.CSV_BLOCK_SIZE', 256)
+    def test_year_columns_typed_beyond_first_block(self):
+        # Year values are empty or integral until well past the first block
+        rows = [f'"Aruba","ABW","Population","SP.POP.TOTL",,{i},' for i in range(20)]
+        rows.append('"Aruba","ABW","Population","SP.POP.TOTL",1.5,2.25,')
+        self.write_zip(rows)
+
+        download_wdi.convert_zip_member_to_parquet(self.zip_path, "WDICSV.csv", self.parquet_path)
+
+        table = pq.read_table(self.parquet_path)
+        self.assertEqual(table.column_names[:6],
+                         ["Country Name", "Country Code", "Indicator Name", "Indicator Code", "1960", "1961"])
+        self.assertEqual(table.schema.field("Country Code").type, pa.string())
+        self.assertEqual(table.schema.field("1960").type, pa.float64())
+        self.assertEqual(table.column("1960").to_pylist()[-1], 1.5)
+        self.assertEqual(table.column("1961").to_pylist()[-1], 2.25)
+        self.assertEqual(table.num_rows, 21)
+
+    def test_failed_conversion_raises(self):
+        self.write_zip(['"Aruba","ABW","Population","SP.POP.TOTL",not-a-number,1,'])
+
+        with self.assertRaises(pa.ArrowInvalid):
+            download_wdi.convert_zip_member_to_parquet(self.zip_path, "WDICSV.csv", self.parquet_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import os
+import sys
+import tempfile
+import duckdb
+import pyarrow.parquet as pq
+
+# Add current directory to path to import script
+sys.path.append(os.getcwd())
+import export_parquet
+
+
+class TestExportMartTablesParquet(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp_dir.name, "test.duckdb")
+        self.output_dir = os.path.join(self.tmp_dir.name, "export")
+        os.makedirs(self.output_dir)
+        conn = duckdb.connect(self.db_file)
+        conn.execute("CREATE TABLE fct_values (id INTEGER, name VARCHAR)")
+        conn.execute("INSERT INTO fct_values VALUES (2, 'b'), (1, 'a'), (3, 'c')")
+        conn.execute("CREATE TABLE dim_country (code VARCHAR)")
+        conn.execute("INSERT INTO dim_country VALUES ('USA'), ('GBR')")
+        conn.execute("CREATE TABLE stg_raw (x INTEGER)")
+        conn.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_exports_only_mart_tables_in_insertion_order(self):
+        exported = export_parquet.export_mart_tables_parquet(self.db_file, self.output_dir)
+
+        self.assertEqual(exported, [
+            os.path.join(self.output_dir, "dim_country.parquet"),
+            os.path.join(self.output_dir, "fct_values.parquet"),
+        ])
+        table = pq.read_table(os.path.join(self.output_dir, "fct_values.parquet"))
+        self.assertEqual(table.column("id").to_pylist(), [2, 1, 3])
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, "stg_raw.parquet")))
+
+    def test_content_hash_ignores_row_order(self):
+        export_parquet.export_mart_tables_parquet(self.db_file, self.output_dir)
+        first = pq.read_metadata(os.path.join(self.output_dir, "fct_values.parquet")).metadata
+
+        conn = duckdb.connect(self.db_file)
+        conn.execute("CREATE OR REPLACE TABLE fct_values AS SELECT * FROM fct_values ORDER BY id DESC")
+        conn.close()
+        export_parquet.export_mart_tables_parquet(self.db_file, self.output_dir)
+        second = pq.read_metadata(os.path.join(self.output_dir, "fct_values.parquet")).metadata
+
+        self.assertIn(b"content_hash", first)
+        self.assertEqual(first[b"content_hash"], second[b"content_hash"])
+
+    def test_view_is_evaluated_once(self):
+        conn = duckdb.connect(self.db_file)
+        conn.execute("CREATE VIEW fct_random AS SELECT random() AS r FROM range(100)")
+        conn.close()
+
+        export_parquet.export_mart_tables_parquet(self.db_file, self.output_dir)
+
+        parquet_file = os.path.join(self.output_dir, "fct_random.parquet")
+        stored_hash = pq.read_metadata(parquet_file).metadata[b"content_hash"].decode()
+        with duckdb.connect() as con:
+            file_hash = con.execute(
+                "SELECT count(*) || ':' || coalesce(sum(hash(r)), 0) FROM read_parquet(?)",
+                [parquet_file]).fetchone()[0]
+        # A second run of the view would draw different values
+        self.assertEqual(stored_hash, file_hash)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+import sys
+
+# Add current directory to path to import script
+sys.path.append(os.getcwd())
+import populate
+
+
+class TestDropPostgresTables(unittest.TestCase):
+
+    def test_names_are_quoted(self):
+        con = MagicMock()
+
+        populate.drop_postgres_tables(con, ["WDICSV", "WDICountry"])
+
+        con.execute.assert_any_call(
+            "CALL postgres_execute('pg', ?)",
+            ['DROP TABLE IF EXISTS public."WDICSV" CASCADE; DROP TABLE IF EXISTS public."WDICountry" CASCADE;'])
+        con.execute.assert_called_with("CALL pg_clear_cache()")
+
+
+if __name__ == '__main__':
+    unittest.main()
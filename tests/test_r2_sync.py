@@ -0,0 +1,94 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import base64
+import hashlib
+import os
+import sys
+import tempfile
+from botocore.exceptions import ClientError
+
+# Add current directory to path to import script
+sys.path.append(os.getcwd())
+import r2_sync
+
+
+class TestR2Sync(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.local_file = os.path.join(self.tmp_dir.name, "data.parquet")
+        with open(self.local_file, "wb") as f:
+            f.write(b"parquet bytes")
+        self.local_md5 = hashlib.md5(b"parquet bytes").hexdigest()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_split_remote_path(self):
+        self.assertEqual(r2_sync.split_remote_path("r2:wdi/sources"), ("wdi", "sources"))
+        self.assertEqual(r2_sync.split_remote_path("r2:wdi"), ("wdi", ""))
+
+    @patch('r2_sync.get_s3_client')
+    def test_sync_to_r2_unchanged(self, mock_get_client):
+        client = MagicMock()
+        client.head_object.return_value = {"ETag": f'"{self.local_md5}"'}
+        mock_get_client.return_value = client
+
+        self.assertFalse(r2_sync.sync_to_r2(self.local_file, "r2:wdi/sources"))
+        client.head_object.assert_called_once_with(Bucket="wdi", Key="sources/data.parquet")
+        client.upload_file.assert_not_called()
+
+    @patch('r2_sync.get_s3_client')
+    def test_sync_to_r2_multipart_metadata_match(self, mock_get_client):
+        client = MagicMock()
+        client.head_object.return_value = {
+            "ETag": '"abc-3"',
+            "Metadata": {"md5chksum": base64.b64encode(bytes.fromhex(self.local_md5)).decode()},
+        }
+        mock_get_client.return_value = client
+
+        self.assertFalse(r2_sync.sync_to_r2(self.local_file, "r2:wdi/sources"))
+        client.upload_file.assert_not_called()
+
+    @patch('r2_sync.get_s3_client')
+    def test_sync_to_r2_missing_remote(self, mock_get_client):
+        client = MagicMock()
+        client.head_object.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        mock_get_client.return_value = client
+
+        self.assertTrue(r2_sync.sync_to_r2(self.local_file, "r2:wdi/raw"))
+        args = client.upload_file.call_args[0]
+        self.assertEqual(args, (self.local_file, "wdi", "raw/data.parquet"))
+        extra_args = client.upload_file.call_args[1]["ExtraArgs"]
+        self.assertEqual(extra_args["ContentType"], "application/octet-stream")
+
+    @patch('r2_sync.get_s3_client')
+    def test_sync_to_r2_guesses_content_type(self, mock_get_client):
+        zip_file = os.path.join(self.tmp_dir.name, "WDI_CSV.zip")
+        with open(zip_file, "wb") as f:
+            f.write(b"zip bytes")
+        client = MagicMock()
+        client.head_object.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        mock_get_client.return_value = client
+
+        self.assertTrue(r2_sync.sync_to_r2(zip_file, "r2:wdi/raw"))
+        extra_args = client.upload_file.call_args[1]["ExtraArgs"]
+        self.assertEqual(extra_args["ContentType"], "application/zip")
+
+    @patch('r2_sync.get_s3_client')
+    def test_sync_to_r2_reuploads_deleted_remote(self, mock_get_client):
+        client = MagicMock()
+        client.head_object.return_value = {"ETag": f'"{self.local_md5}"'}
+        mock_get_client.return_value = client
+
+        self.assertFalse(r2_sync.sync_to_r2(self.local_file, "r2:wdi/sources"))
+        client.upload_file.assert_not_called()
+
+        # The object was deleted from R2 since the last sync
+        client.head_object.side_effect = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        self.assertTrue(r2_sync.sync_to_r2(self.local_file, "r2:wdi/sources"))
+        client.upload_file.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
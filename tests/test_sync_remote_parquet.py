@@ -2,7 +2,9 @@ import unittest
 from unittest.mock import patch, MagicMock
 import tempfile
 import os
+import subprocess
 import pandas as pd
+import duckdb
 import sys
 
 # Add current directory to path to import script
@@ -40,9 +42,25 @@ class TestSyncRemoteParquet(unittest.TestCase):
         self.assertNotIn("/tmp/old_file.parquet", changed)
 
     @patch('sync_remote_parquet.subprocess.run')
-    @patch('sync_remote_parquet.load_and_sort_parquet_file')
-    @patch('sync_remote_parquet.pd.testing.assert_frame_equal')
-    def test_get_changed_files_diff_content(self, mock_assert, mock_load, mock_run):
+    def test_get_changed_files_multiple_directories(self, mock_run):
+        listed = []
+
+        def side_effect(cmd, **kwargs):
+            listed.append(open(cmd[5]).read())
+            return MagicMock(stdout="+ marts/new_file.parquet\n= staging/old_file.parquet\n", returncode=1)
+
+        mock_run.side_effect = side_effect
+
+        local_files = ["/tmp/out/staging/old_file.parquet", "/tmp/out/marts/new_file.parquet"]
+        changed = sync_remote_parquet.get_changed_files(local_files, "r2:wdi", "/tmp/download")
+
+        self.assertEqual(mock_run.call_args[0][0][2], "/tmp/out")
+        self.assertEqual(listed, ["staging/old_file.parquet\nmarts/new_file.parquet\n"])
+        self.assertEqual(changed, ["/tmp/out/marts/new_file.parquet"])
+
+    @patch('sync_remote_parquet.subprocess.run')
+    @patch('sync_remote_parquet.parquet_files_differ', return_value=True)
+    def test_get_changed_files_diff_content(self, mock_differ, mock_run):
         def side_effect(*args, **kwargs):
             cmd = args[0]
             if cmd[1] == "check":
@@ -60,12 +78,6 @@ class TestSyncRemoteParquet(unittest.TestCase):
         remote_base = "r2:wdi"
         temp_dir = "/tmp/download"
 
-        # Mock load_and_sort to return dataframes
-        mock_load.return_value = pd.DataFrame({'a': [1]})
-
-        # Mock assert_frame_equal to raise AssertionError
-        mock_assert.side_effect = AssertionError("Mismatch")
-
         changed = sync_remote_parquet.get_changed_files(local_files, remote_base, temp_dir)
         self.assertIn("/tmp/changed.parquet", changed)
 
@@ -75,9 +87,8 @@ class TestSyncRemoteParquet(unittest.TestCase):
         self.assertTrue(any(call[0][0][1] == "copy" for call in calls))
 
     @patch('sync_remote_parquet.subprocess.run')
-    @patch('sync_remote_parquet.load_and_sort_parquet_file')
-    @patch('sync_remote_parquet.pd.testing.assert_frame_equal')
-    def test_get_changed_files_diff_checksum_match_content(self, mock_assert, mock_load, mock_run):
+    @patch('sync_remote_parquet.parquet_files_differ', return_value=False)
+    def test_get_changed_files_diff_checksum_match_content(self, mock_differ, mock_run):
         # Case where rclone check says diff (*), but pandas says equal (fuzzy match)
         def side_effect(*args, **kwargs):
             cmd = args[0]
@@ -96,12 +107,6 @@ class TestSyncRemoteParquet(unittest.TestCase):
         remote_base = "r2:wdi"
         temp_dir = "/tmp/download"
 
-        # Mock load_and_sort
-        mock_load.return_value = pd.DataFrame({'a': [1.00001]})
-
-        # Mock assert_frame_equal to pass (no exception raised)
-        mock_assert.return_value = None
-
         changed = sync_remote_parquet.get_changed_files(local_files, remote_base, temp_dir)
         # Should NOT be in changed list
         self.assertNotIn("/tmp/fuzzy_match.parquet", changed)
@@ -111,5 +116,180 @@ class TestSyncRemoteParquet(unittest.TestCase):
         calls = mock_run.call_args_list
         self.assertTrue(any(call[0][0][1] == "copy" for call in calls))
 
+    @patch('sync_remote_parquet.subprocess.run')
+    def test_sync_local_to_remote_single_call(self, mock_run):
+        listed = []
+        mock_run.side_effect = lambda cmd, **kwargs: listed.append(open(cmd[5]).read())
+
+        sync_remote_parquet.sync_local_to_remote(["/tmp/out/#a.parquet", "/tmp/out/b.parquet"], "r2:wdi")
+
+        mock_run.assert_called_once()
+        cmd = mock_run.call_args[0][0]
+        self.assertEqual(cmd[:5], ["rclone", "copy", "/tmp/out", "r2:wdi", "--files-from-raw"])
+        self.assertEqual(listed, ["#a.parquet\nb.parquet\n"])
+
+    @patch('sync_remote_parquet.subprocess.run')
+    def test_check_and_sync_share_root(self, mock_run):
+        listed = []
+
+        def side_effect(cmd, **kwargs):
+            listed.append((cmd[1], cmd[2], open(cmd[5]).read()))
+            return MagicMock(stdout="+ marts/new.parquet\n= staging/old.parquet\n", returncode=1)
+
+        mock_run.side_effect = side_effect
+
+        local_files = ["/tmp/out/staging/old.parquet", "/tmp/out/marts/new.parquet"]
+        root = sync_remote_parquet.common_root(local_files)
+        changed = sync_remote_parquet.get_changed_files(local_files, "r2:wdi", "/tmp/download", root)
+        sync_remote_parquet.sync_local_to_remote(changed, "r2:wdi", root)
+
+        self.assertEqual(listed[1], ("copy", "/tmp/out", "marts/new.parquet\n"))
+
+    @patch('sync_remote_parquet.subprocess.run')
+    def test_failed_check_raises(self, mock_run):
+        mock_run.return_value = MagicMock(stdout="", stderr="auth failed", returncode=7)
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            sync_remote_parquet.get_changed_files(["/tmp/file1.parquet"], "r2:wdi", "/tmp/download")
+
+    @patch('sync_remote_parquet.subprocess.run')
+    def test_unreported_file_raises(self, mock_run):
+        mock_run.return_value = MagicMock(stdout="= file1.parquet\n", returncode=1)
+
+        with self.assertRaises(RuntimeError):
+            sync_remote_parquet.get_changed_files(
+                ["/tmp/file1.parquet", "/tmp/file2.parquet"], "r2:wdi", "/tmp/download")
+
+    @patch('sync_remote_parquet.subprocess.run')
+    @patch('sync_remote_parquet.parquet_files_differ', return_value=False)
+    def test_classify_files_reports_matching_files(self, mock_differ, mock_run):
+        mock_run.return_value = MagicMock(stdout="= same.parquet\n* fuzzy_match.parquet\n", returncode=1)
+
+        changed, unchanged = sync_remote_parquet.classify_files(
+            ["/tmp/same.parquet", "/tmp/fuzzy_match.parquet"], "r2:wdi", "/tmp/download")
+
+        self.assertEqual(changed, [])
+        self.assertEqual(sorted(unchanged), ["/tmp/fuzzy_match.parquet", "/tmp/same.parquet"])
+
+    @patch('sync_remote_parquet.subprocess.run')
+    @patch('sync_remote_parquet.parquet_files_differ')
+    def test_fingerprint_matches_still_checked(self, mock_differ, mock_run):
+        mock_run.return_value = MagicMock(stdout="* reordered.parquet\n+ deleted.parquet\n", returncode=1)
+
+        changed, unchanged = sync_remote_parquet.classify_files(
+            ["/tmp/reordered.parquet", "/tmp/deleted.parquet"], "r2:wdi", "/tmp/download",
+            fingerprint_matches={"reordered.parquet", "deleted.parquet"})
+
+        # Deleted from the remote despite the manifest entry, so uploaded again
+        self.assertEqual(changed, ["/tmp/deleted.parquet"])
+        self.assertEqual(unchanged, ["/tmp/reordered.parquet"])
+        # Only the rclone check ran; nothing was downloaded for comparison
+        mock_run.assert_called_once()
+        mock_differ.assert_not_called()
+
+class TestParquetFilesDiffer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_parquet(self, name, df):
+        path = os.path.join(self.tmp_dir.name, name)
+        df.to_parquet(path, engine="pyarrow", index=False)
+        return path
+
+    def test_row_order_and_small_float_drift_match(self):
+        local_file = self.write_parquet("local.parquet", pd.DataFrame(
+            {"code": ["USA", "GBR", None], "value": [1.0, 2.00001, float("nan")]}))
+        remote_file = self.write_parquet("remote.parquet", pd.DataFrame(
+            {"code": [None, "GBR", "USA"], "value": [float("nan"), 2.0, 1.0001]}))
+
+        self.assertFalse(sync_remote_parquet.parquet_files_differ(local_file, remote_file))
+
+    def test_changed_value_differs(self):
+        local_file = self.write_parquet("local.parquet", pd.DataFrame({"code": ["USA"], "value": [1.0]}))
+        remote_file = self.write_parquet("remote.parquet", pd.DataFrame({"code": ["USA"], "value": [1.1]}))
+
+        self.assertTrue(sync_remote_parquet.parquet_files_differ(local_file, remote_file))
+
+    def test_extra_row_differs(self):
+        local_file = self.write_parquet("local.parquet", pd.DataFrame({"code": ["USA", "GBR"]}))
+        remote_file = self.write_parquet("remote.parquet", pd.DataFrame({"code": ["USA"]}))
+
+        # Decided from the footers alone
+        with patch('sync_remote_parquet.duckdb.connect') as mock_connect:
+            self.assertTrue(sync_remote_parquet.parquet_files_differ(local_file, remote_file))
+        mock_connect.assert_not_called()
+
+    def test_matching_content_hash_skips_scan(self):
+        local_file = os.path.join(self.tmp_dir.name, "local.parquet")
+        remote_file = os.path.join(self.tmp_dir.name, "remote.parquet")
+        with duckdb.connect() as con:
+            con.execute(f"COPY (SELECT 1 AS id) TO '{local_file}' (FORMAT 'parquet', KV_METADATA {{content_hash: 'abc'}})")
+            con.execute(f"COPY (SELECT 1 AS id) TO '{remote_file}' (FORMAT 'parquet', KV_METADATA {{content_hash: 'abc'}})")
+
+        with patch('sync_remote_parquet.duckdb.connect') as mock_connect:
+            self.assertFalse(sync_remote_parquet.parquet_files_differ(local_file, remote_file))
+        mock_connect.assert_not_called()
+
+    def test_schema_change_differs(self):
+        local_file = self.write_parquet("local.parquet", pd.DataFrame({"code": ["USA"], "value": [1]}))
+        remote_file = self.write_parquet("remote.parquet", pd.DataFrame({"code": ["USA"], "population": [1]}))
+
+        self.assertTrue(sync_remote_parquet.parquet_files_differ(local_file, remote_file))
+
+class TestParquetManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_parquet(self, name, query, content_hash=None):
+        path = os.path.join(self.tmp_dir.name, name)
+        options = f", KV_METADATA {{content_hash: '{content_hash}'}}" if content_hash else ""
+        with duckdb.connect() as con:
+            con.execute(f"COPY ({query}) TO '{path}' (FORMAT 'parquet'{options})")
+        return path
+
+    def test_build_local_manifest(self):
+        hashed = self.write_parquet("fct_a.parquet", "SELECT 1 AS id", "abc")
+        renamed = self.write_parquet("fct_b.parquet", "SELECT 1 AS code", "abc")
+        unhashed = self.write_parquet("fct_c.parquet", "SELECT 1 AS id")
+
+        manifest = sync_remote_parquet.build_local_manifest([hashed, renamed, unhashed], self.tmp_dir.name)
+
+        self.assertEqual(sorted(manifest), ["fct_a.parquet", "fct_b.parquet"])
+        # Same content hash, different schema
+        self.assertNotEqual(manifest["fct_a.parquet"], manifest["fct_b.parquet"])
+
+    def test_manifest_keys_are_relative_paths(self):
+        os.makedirs(os.path.join(self.tmp_dir.name, "marts"))
+        os.makedirs(os.path.join(self.tmp_dir.name, "staging"))
+        marts = self.write_parquet(os.path.join("marts", "fct_a.parquet"), "SELECT 1 AS id", "abc")
+        staging = self.write_parquet(os.path.join("staging", "fct_a.parquet"), "SELECT 2 AS id", "def")
+
+        manifest = sync_remote_parquet.build_local_manifest([marts, staging], self.tmp_dir.name)
+
+        self.assertEqual(sorted(manifest), ["marts/fct_a.parquet", "staging/fct_a.parquet"])
+
+    @patch('sync_remote_parquet.subprocess.run')
+    def test_missing_remote_manifest(self, mock_run):
+        mock_run.return_value = MagicMock(returncode=1, stdout="")
+
+        self.assertEqual(sync_remote_parquet.load_remote_manifest("r2:wdi"), {})
+        mock_run.assert_called_once_with(
+            ["rclone", "cat", "r2:wdi/parquet_manifest.json"],
+            capture_output=True, text=True, check=False)
+
+    @patch('sync_remote_parquet.subprocess.run')
+    def test_non_object_remote_manifest(self, mock_run):
+        mock_run.return_value = MagicMock(returncode=0, stdout="[]")
+
+        self.assertEqual(sync_remote_parquet.load_remote_manifest("r2:wdi"), {})
+
 if __name__ == '__main__':
     unittest.main()
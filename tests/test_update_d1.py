@@ -1,8 +1,12 @@
 
 import unittest
+from unittest.mock import patch
 import os
+import sqlite3
 import tempfile
-from update_d1 import split_file
+import duckdb
+import update_d1
+from update_d1 import split_file, map_type, export_duckdb_to_sql
 
 class TestSplitFile(unittest.TestCase):
     def setUp(self):
@@ -59,5 +63,139 @@ class TestSplitFile(unittest.TestCase):
         chunks = split_file(self.tmp_file, max_lines=10)
         self.assertEqual(len(chunks), 3) # 10, 10, 5
 
+    def test_max_bytes(self):
+        self.create_file(10) # "line 0\n" .. "line 9\n", 7 bytes each
+        chunks = split_file(self.tmp_file, max_lines=100, max_bytes=21)
+        self.assertEqual(len(chunks), 4) # 3, 3, 3, 1
+
+        with open(chunks[1], 'r') as f:
+            self.assertEqual(f.readlines(), ["line 3\n", "line 4\n", "line 5\n"])
+
+    def test_line_longer_than_max_bytes(self):
+        self.create_file(3)
+        chunks = split_file(self.tmp_file, max_lines=100, max_bytes=4)
+        self.assertEqual(len(chunks), 3)
+
+class TestMapType(unittest.TestCase):
+    def test_numeric_types(self):
+        for data_type in ("INTEGER", "BIGINT", "DOUBLE", "DECIMAL(18,3)", "double"):
+            self.assertEqual(map_type(data_type), "DOUBLE")
+
+    def test_other_types_are_text(self):
+        for data_type in ("VARCHAR", "DATE", "INTERVAL", "INTEGER[]"):
+            self.assertEqual(map_type(data_type), "VARCHAR")
+
+class TestExportDuckdbToSql(unittest.TestCase):
+    def test_statements_load_into_sqlite(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            duckdb_filename = os.path.join(tmp_dir, "wdi.duckdb")
+            with duckdb.connect(duckdb_filename) as con:
+                con.execute("CREATE TABLE fct_x(id INTEGER, name VARCHAR, value DOUBLE)")
+                con.execute("""INSERT INTO fct_x VALUES
+                    (1, 'it''s', 1.5), (2, E'two\\nlines\\r', NULL), (3, NULL, 'inf'::DOUBLE)""")
+                con.execute("CREATE TABLE fct_empty(id INTEGER)")
+
+            exports = export_duckdb_to_sql(
+                duckdb_filename, tmp_dir, tables_to_export=["fct_x", "fct_empty"])
+
+            self.assertEqual(exports["fct_empty"][1], None)
+            create_statement, insert_file = exports["fct_x"]
+            self.assertEqual(create_statement,
+                             'CREATE TABLE "fct_x"("id" REAL, "name" TEXT, "value" REAL) STRICT;')
+            with open(insert_file) as f:
+                lines = f.readlines()
+            # All three rows fit in one multi-row INSERT
+            self.assertEqual(len(lines), 1)
+
+            sqlite_conn = sqlite3.connect(":memory:")
+            sqlite_conn.execute(create_statement)
+            for line in lines:
+                sqlite_conn.execute(line)
+            rows = sqlite_conn.execute("SELECT * FROM fct_x ORDER BY id").fetchall()
+            sqlite_conn.close()
+
+        self.assertEqual(rows, [
+            (1.0, "it's", 1.5),
+            (2.0, "two\nlines\r", None),
+            (3.0, None, float("inf")),
+        ])
+
+    def test_views_are_exported(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            duckdb_filename = os.path.join(tmp_dir, "wdi.duckdb")
+            with duckdb.connect(duckdb_filename) as con:
+                con.execute("CREATE TABLE stg_x AS SELECT 1 AS id")
+                con.execute("CREATE VIEW fct_x AS SELECT id, 'a' AS name FROM stg_x")
+
+            exports = export_duckdb_to_sql(duckdb_filename, tmp_dir, tables_to_export=["fct_x"])
+
+            create_statement, insert_file = exports["fct_x"]
+            self.assertEqual(create_statement, 'CREATE TABLE "fct_x"("id" REAL, "name" TEXT) STRICT;')
+            with open(insert_file) as f:
+                self.assertEqual(f.read(), 'INSERT INTO "fct_x" VALUES(1.0,\'a\');\n')
+
+    @patch('update_d1.INSERT_STATEMENT_BYTES', 20)
+    def test_rows_are_grouped_into_bounded_statements(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            duckdb_filename = os.path.join(tmp_dir, "wdi.duckdb")
+            with duckdb.connect(duckdb_filename) as con:
+                con.execute("CREATE TABLE fct_x AS SELECT range AS id FROM range(100)")
+
+            exports = export_duckdb_to_sql(duckdb_filename, tmp_dir, tables_to_export=["fct_x"])
+
+            create_statement, insert_file = exports["fct_x"]
+            with open(insert_file) as f:
+                lines = f.readlines()
+            self.assertGreater(len(lines), 1)
+
+            sqlite_conn = sqlite3.connect(":memory:")
+            sqlite_conn.execute(create_statement)
+            for line in lines:
+                sqlite_conn.execute(line)
+            ids = [row[0] for row in sqlite_conn.execute("SELECT id FROM fct_x ORDER BY id")]
+            sqlite_conn.close()
+
+        self.assertEqual(ids, [float(i) for i in range(100)])
+
+class TestExecuteD1File(unittest.TestCase):
+    def tearDown(self):
+        update_d1.get_wrangler_command.cache_clear()
+
+    @patch('update_d1.subprocess.run')
+    @patch('update_d1.shutil.which', return_value=None)
+    def test_falls_back_to_npx(self, mock_which, mock_run):
+        update_d1.execute_d1_file("fct_x.sql", "local")
+        update_d1.execute_d1_file("fct_y.sql", "remote")
+
+        mock_which.assert_called_once_with("wrangler")
+        mock_run.assert_called_with(
+            ["npx", "--yes", "--prefer-offline", "wrangler@latest", "d1", "execute", "wdi", "--remote", "--file", "fct_y.sql", "--yes"],
+            check=True)
+
+    @patch('update_d1.subprocess.run')
+    @patch('update_d1.shutil.which', return_value="/usr/bin/wrangler")
+    def test_uses_installed_wrangler(self, mock_which, mock_run):
+        update_d1.execute_d1_file("fct_x.sql", "local")
+
+        mock_run.assert_called_once_with(
+            ["/usr/bin/wrangler", "d1", "execute", "wdi", "--local", "--file", "fct_x.sql", "--yes"],
+            check=True)
+
+class TestUpdateD1TableFromDumpChunks(unittest.TestCase):
+    @patch('update_d1.update_d1_table_from_dump')
+    def test_executes_every_chunk(self, mock_update):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dump_file = os.path.join(tmp_dir, "fct_x.sql")
+            with open(dump_file, "w") as f:
+                for i in range(25):
+                    f.write(f'INSERT INTO "fct_x" VALUES({i});\n')
+
+            update_d1.update_d1_table_from_dump_chunks(dump_file, "remote", max_lines=10)
+
+            executed = [call.args for call in mock_update.call_args_list]
+            self.assertEqual(executed, [
+                (os.path.join(tmp_dir, f"fct_x_chunk_{i}.sql"), "remote") for i in range(3)
+            ])
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,40 +1,103 @@
 #!/usr/bin/env python3
 # filepath: /workspaces/dbt-duckdb/update_d1.py
 import os
+import shutil
 import subprocess
 import tempfile
 import duckdb
-import re
 import json
 import argparse
 import time
-from itertools import islice
-
-
-def export_duckdb_to_sqlite(duckdb_filename: str, sqlite_filename: str, sample: bool = False, tables_to_export: list = None) -> None:
+from functools import lru_cache
+from itertools import chain
+from pipeline_common import quote_identifier
+
+# DuckDB base types exported to SQLite as numbers; everything else is exported as text.
+SQLITE_EXPORT_TYPES = dict.fromkeys((
+    "TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT",
+    "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT", "UHUGEINT",
+    "FLOAT", "DOUBLE", "DECIMAL",
+), "DOUBLE")
+
+# SQLite column type for each export type. D1 tables are created STRICT, which
+# only accepts SQLite's own type names, so values of the wrong type are
+# rejected instead of being stored under a loose affinity.
+SQLITE_COLUMN_TYPES = {"DOUBLE": "REAL", "VARCHAR": "TEXT"}
+
+
+# Target size of the VALUES list in each generated INSERT statement. D1 caps a
+# single statement at 100 KB; a statement can overshoot the target by at most
+# one row.
+INSERT_STATEMENT_BYTES = 50_000
+
+# Statements and bytes per file sent to D1; whichever is reached first ends
+# the chunk.
+D1_CHUNK_STATEMENTS = 1000
+D1_CHUNK_BYTES = 50 * 1024 * 1024
+
+
+def map_type(data_type: str) -> str:
+    # Strip any parameters, e.g. DECIMAL(18,3) -> DECIMAL; list types such as
+    # INTEGER[] don't match and fall back to VARCHAR.
+    return SQLITE_EXPORT_TYPES.get(data_type.split("(", 1)[0].upper(), "VARCHAR")
+
+
+def sqlite_literal_sql(col_name: str, col_type: str) -> str:
+    # DuckDB expression rendering a column value as a SQLite literal, the way
+    # sqlite3 .dump did. Newlines are spliced in with char() so every INSERT
+    # stays on a single line for split_file.
+    col = f"CAST({quote_identifier(col_name)} AS {col_type})"
+    if col_type == "DOUBLE":
+        return (
+            f"CASE WHEN {col} IS NULL OR isnan({col}) THEN 'NULL' "
+            f"WHEN isinf({col}) THEN CASE WHEN {col} > 0 THEN '1e999' ELSE '-1e999' END "
+            f"ELSE CAST({col} AS VARCHAR) END"
+        )
+    escaped = (
+        f"replace(replace(replace({col}, '''', ''''''), "
+        "chr(10), '''||char(10)||'''), chr(13), '''||char(13)||''')"
+    )
+    return f"CASE WHEN {col} IS NULL THEN 'NULL' ELSE '''' || {escaped} || '''' END"
+
+
+def build_create_table_sql(table_name: str, columns_info: list) -> str:
+    column_defs = ", ".join(
+        f"{quote_identifier(col_name)} {SQLITE_COLUMN_TYPES[map_type(data_type)]}"
+        for col_name, data_type in columns_info)
+    return f"CREATE TABLE {quote_identifier(table_name)}({column_defs}) STRICT;"
+
+
+def export_duckdb_to_sql(duckdb_filename: str, output_dir: str, sample: bool = False, tables_to_export: list = None) -> dict:
+    """
+    Writes a file of INSERT statements for each table directly from DuckDB.
+    Returns a dict mapping each exported table to a tuple of its CREATE TABLE
+    statement and its INSERT file (None if the table has no rows).
+    """
     if not tables_to_export:
         print("No tables provided for export. Skipping export.")
-        return
-    if os.path.exists(sqlite_filename):
-        print(f"Overwriting existing {sqlite_filename} file.")
-        os.remove(sqlite_filename)
+        return {}
     duck_conn = duckdb.connect(duckdb_filename, read_only=True)
-    # Attach SQLite database. The 'READ_ONLY false' option allows writing to the attached DB
-    # even if the main DuckDB connection is read-only.
-    duck_conn.execute(f"ATTACH '{sqlite_filename}' AS sqlite_db (TYPE SQLITE, READ_ONLY false)")
 
-    all_tables = duck_conn.execute("SHOW TABLES;").fetchall()
-    tables = [t for t in all_tables if t[0] in tables_to_export]
+    # Let DuckDB filter the catalog down to the requested tables. Views are
+    # included, as SHOW TABLES did: dbt builds the marts as views by default.
+    tables = duck_conn.execute("""
+        SELECT table_name FROM information_schema.tables
+        WHERE table_schema = 'main' AND table_name = ANY(?)
+        ORDER BY table_name
+    """, [list(tables_to_export)]).fetchall()
     if not tables:
         print("No matching tables found in DuckDB. Skipping export.")
         duck_conn.close()
-        return
+        return {}
     print(
         f"Exporting only the following tables: {', '.join([t[0] for t in tables])}")
 
     # Fetch all column metadata in a single query to avoid N+1 performance issue
-    all_columns_query = "SELECT table_name, column_name, data_type FROM information_schema.columns ORDER BY table_name, ordinal_position"
-    all_columns_info = duck_conn.execute(all_columns_query).fetchall()
+    all_columns_info = duck_conn.execute("""
+        SELECT table_name, column_name, data_type FROM information_schema.columns
+        WHERE table_schema = 'main' AND table_name = ANY(?)
+        ORDER BY table_name, ordinal_position
+    """, [[t[0] for t in tables]]).fetchall()
 
     table_columns = {}
     for t_name, c_name, d_type in all_columns_info:
@@ -42,6 +105,7 @@ def export_duckdb_to_sqlite(duckdb_filename: str, sqlite_filename: str, sample:
             table_columns[t_name] = []
         table_columns[t_name].append((c_name, d_type))
 
+    exports = {}
     for row in tables:
         table_name = row[0]
         print(f" * Exporting table: {table_name}")
@@ -49,136 +113,130 @@ def export_duckdb_to_sqlite(duckdb_filename: str, sqlite_filename: str, sample:
         if not columns_info:
             print(f"Warning: No column info for table {table_name}")
             continue
-        select_cols = []
-        for col in columns_info:
-            col_name = col[0]
-            col_type = "VARCHAR" if "text" in col[1].lower() else "DOUBLE" if (
-                "double" in col[1].lower() or "int" in col[1].lower()) else "VARCHAR"
-            select_cols.append(f'CAST("{col_name}" AS {col_type}) AS "{col_name}"')
-
-        # Perform single CREATE TABLE AS SELECT to avoid N+1 query overhead
-        select_clause = ", ".join(select_cols)
-        where_clause = " WHERE random() < 0.01" if sample else ""
-
-        ctas_query = f'CREATE TABLE sqlite_db."{table_name}" AS SELECT {select_clause} FROM {table_name}{where_clause}'
 
-        # Execute CTAS and get the row count natively returned by DuckDB
-        total_rows = duck_conn.execute(ctas_query).fetchone()[0]
-
-        if total_rows == 0:
+        # DuckDB renders the rows as multi-row INSERT statements and writes the
+        # lines itself; QUOTE '' stops the CSV writer quoting the single column.
+        # Rows are grouped by their running byte offset, so each statement
+        # carries about INSERT_STATEMENT_BYTES of VALUES.
+        values_sql = " || ',' || ".join(
+            sqlite_literal_sql(col_name, map_type(data_type)) for col_name, data_type in columns_info)
+        insert_prefix = f"INSERT INTO {quote_identifier(table_name)} VALUES".replace("'", "''")
+        where_clause = " WHERE random() < 0.01" if sample else ""
+        insert_file = os.path.join(output_dir, f"{table_name}.sql")
+        copy_query = f"""
+        COPY (
+            WITH row_values AS (
+                SELECT '(' || {values_sql} || ')' AS row_sql, row_number() OVER () AS row_id
+                FROM main.{quote_identifier(table_name)}{where_clause}
+            ), row_groups AS (
+                SELECT row_sql, row_id,
+                       (sum(strlen(row_sql) + 1) OVER (ORDER BY row_id) - strlen(row_sql) - 1)
+                           // {INSERT_STATEMENT_BYTES} AS statement_id
+                FROM row_values
+            )
+            SELECT '{insert_prefix}' || string_agg(row_sql, ',' ORDER BY row_id) || ';'
+            FROM row_groups
+            GROUP BY statement_id
+            ORDER BY statement_id
+        ) TO '{insert_file}' (FORMAT CSV, HEADER false, QUOTE '', ESCAPE '')
+        """
+        total_statements = duck_conn.execute(copy_query).fetchone()[0]
+
+        if total_statements == 0:
             print(f'Warning: Table "{table_name}" has no rows.')
+            insert_file = None
         else:
-            print(f'Inserted {total_rows} rows into "{table_name}".')
+            print(f'Wrote {total_statements} INSERT statements for "{table_name}" to {insert_file}.')
+        exports[table_name] = (build_create_table_sql(table_name, columns_info), insert_file)
 
-    duck_conn.execute("DETACH sqlite_db")
     duck_conn.close()
-    print("Export to SQLite complete.")
-
-
-def dump_table_from_sqlite(db_filename: str, table: str, output_file: str) -> None:
-    dump_cmd = f'sqlite3 {db_filename} ".dump {table}"'
-    # Use Popen to stream the output line by line to avoid loading the entire dump into memory
-    with subprocess.Popen(dump_cmd, shell=True, stdout=subprocess.PIPE, text=True) as process:
-        skip_kv_block = False
-        total_lines = 0
-        skipped_lines = 0
-        kv_pattern = re.compile(r'^CREATE TABLE _cf_KV ')
-
-        with open(output_file, "w", encoding="utf-8") as f:
-            for line in process.stdout:
-                total_lines += 1
-                if line.startswith("BEGIN TRANSACTION;") or line.startswith("COMMIT;"):
-                    skipped_lines += 1
-                    continue
-                if kv_pattern.match(line):
-                    skip_kv_block = True
-                    skipped_lines += 1
-                    continue
-                if skip_kv_block:
-                    skipped_lines += 1
-                    if "WITHOUT ROWID;" in line:
-                        skip_kv_block = False
-                    continue
-                f.write(line)
+    print("Export to SQL complete.")
+    return exports
 
-        process.wait()
-        if process.returncode != 0:
-            raise subprocess.CalledProcessError(process.returncode, dump_cmd)
 
-    print(
-        f"Dumped and cleaned table {table} to {output_file}. Processed {total_lines} lines, skipped {skipped_lines} lines.")
+@lru_cache(maxsize=None)
+def get_wrangler_command() -> tuple:
+    # Every "npx wrangler@latest" call resolves the package again before Node
+    # even starts wrangler, so use an installed wrangler when there is one.
+    wrangler = shutil.which("wrangler")
+    if wrangler:
+        return (wrangler,)
+    # Otherwise let npx reuse cached registry metadata instead of asking again
+    return ("npx", "--yes", "--prefer-offline", "wrangler@latest")
+
+
+def execute_d1_file(sql_file: str, d1_mode: str) -> None:
+    flag = "--local" if d1_mode == "local" else "--remote"
+    cmd = [*get_wrangler_command(), "d1", "execute", "wdi", flag, "--file", sql_file, "--yes"]
+    subprocess.run(cmd, check=True)
 
 
-def drop_mart_tables_from_d1(tables: list, d1_mode: str, work_dir: str) -> None:
+def drop_mart_tables_from_d1(tables: list, d1_mode: str, work_dir: str, create_statements: list = None) -> None:
     if not tables:
         return
-    flag = "--local" if d1_mode == "local" else "--remote"
     drop_sql_file = os.path.join(work_dir, "drop_tables.sql")
     with open(drop_sql_file, "w", encoding="utf-8") as f:
         for table in tables:
             f.write(f"DROP TABLE IF EXISTS {table};\n")
+        # Recreate the exported tables in the same wrangler call
+        for create_statement in create_statements or []:
+            f.write(f"{create_statement}\n")
 
-    drop_cmd = f"npx wrangler@latest d1 execute wdi {flag} --file {drop_sql_file} --yes"
-    subprocess.run(drop_cmd, shell=True, check=True)
+    execute_d1_file(drop_sql_file, d1_mode)
     print(f"Dropped {len(tables)} tables from D1 database 'wdi'.")
 
 
-def split_file(file_path: str, max_lines: int = 50000) -> list:
+def split_file(file_path: str, max_lines: int = 50000, max_bytes: int = None) -> list:
     """
-    Splits the file at file_path into chunks with up to max_lines each.
-    Returns a list of chunk file paths. If the file is short enough,
-    returns a list with the original file.
+    Splits the file at file_path into chunks with up to max_lines each and,
+    if max_bytes is given, no more than max_bytes each (a single longer line
+    gets a chunk of its own). Returns a list of chunk file paths. If the file
+    is small enough, returns a list with the original file.
     """
     base, ext = os.path.splitext(file_path)
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        # Read the first batch of lines
-        first_chunk = list(islice(f, max_lines))
-
-        # If we reached EOF and haven't filled the chunk
-        if len(first_chunk) < max_lines:
-            return [file_path]
-
-        # Check if there is at least one more line
-        try:
-            peek = next(f)
-        except StopIteration:
-            # File has exactly max_lines. No need to split.
+    def chunk_full(num_lines, num_bytes, line):
+        if not num_lines:
+            return False
+        return num_lines >= max_lines or (max_bytes is not None and num_bytes + len(line) > max_bytes)
+
+    # Lines are copied as raw bytes; they never need decoding to be split.
+    with open(file_path, "rb") as f:
+        # Read the first chunk; if the file ends inside it, no split is needed.
+        first_chunk = []
+        first_bytes = 0
+        for line in f:
+            if chunk_full(len(first_chunk), first_bytes, line):
+                break
+            first_chunk.append(line)
+            first_bytes += len(line)
+        else:
             return [file_path]
 
-        # If we are here, we have max_lines + 1 lines (at least). We must split.
         chunk_files = []
-        chunk_index = 0
-
-        # Write the first chunk (from the initial buffer)
-        chunk_file = f"{base}_chunk_{chunk_index}{ext}"
-        with open(chunk_file, "w", encoding="utf-8") as cf:
+        chunk_file = f"{base}_chunk_{len(chunk_files)}{ext}"
+        with open(chunk_file, "wb") as cf:
             cf.writelines(first_chunk)
         chunk_files.append(chunk_file)
-        chunk_index += 1
-
-        # Second chunk processing
-        chunk_file = f"{base}_chunk_{chunk_index}{ext}"
-        with open(chunk_file, "w", encoding="utf-8") as cf:
-            cf.write(peek)
-            # Write up to max_lines - 1 more lines
-            cf.writelines(islice(f, max_lines - 1))
-        chunk_files.append(chunk_file)
-        chunk_index += 1
-
-        # Continue processing remaining chunks
-        while True:
-            try:
-                line = next(f)
-            except StopIteration:
-                break
 
-            chunk_file = f"{base}_chunk_{chunk_index}{ext}"
-            with open(chunk_file, "w", encoding="utf-8") as cf:
+        # Stream the rest, starting with the line that didn't fit
+        cf = None
+        num_lines = num_bytes = 0
+        try:
+            for line in chain([line], f):
+                if cf is None or chunk_full(num_lines, num_bytes, line):
+                    if cf is not None:
+                        cf.close()
+                    chunk_file = f"{base}_chunk_{len(chunk_files)}{ext}"
+                    cf = open(chunk_file, "wb")
+                    chunk_files.append(chunk_file)
+                    num_lines = num_bytes = 0
                 cf.write(line)
-                cf.writelines(islice(f, max_lines - 1))
-            chunk_files.append(chunk_file)
-            chunk_index += 1
+                num_lines += 1
+                num_bytes += len(line)
+        finally:
+            if cf is not None:
+                cf.close()
 
     print(
         f"Split {file_path} into {len(chunk_files)} chunks (threshold = {max_lines} lines).")
@@ -186,13 +244,11 @@ def split_file(file_path: str, max_lines: int = 50000) -> list:
 
 
 def update_d1_table_from_dump(sql_dump_file: str, d1_mode: str) -> None:
-    flag = "--local" if d1_mode == "local" else "--remote"
-    update_cmd = f"npx wrangler@latest d1 execute wdi {flag} --file {sql_dump_file} --yes"
     max_retries = 3
     attempt = 0
     while attempt < max_retries:
         try:
-            subprocess.run(update_cmd, shell=True, check=True)
+            execute_d1_file(sql_dump_file, d1_mode)
             print(f"Updated D1 table using dump file {sql_dump_file}.")
             return
         except subprocess.CalledProcessError as e:
@@ -207,12 +263,13 @@ def update_d1_table_from_dump(sql_dump_file: str, d1_mode: str) -> None:
                 time.sleep(wait_time)
 
 
-def update_d1_table_from_dump_chunks(sql_dump_file: str, d1_mode: str, max_lines: int = 50000) -> None:
+def update_d1_table_from_dump_chunks(sql_dump_file: str, d1_mode: str, max_lines: int = 50000, max_bytes: int = None) -> None:
     """
     Splits the sql_dump_file into chunks (if necessary) and then updates D1
-    by executing each chunk sequentially.
+    by executing the chunks one after another. D1 applies writes to a
+    database one at a time and can reject an import while another runs.
     """
-    chunk_files = split_file(sql_dump_file, max_lines=max_lines)
+    chunk_files = split_file(sql_dump_file, max_lines=max_lines, max_bytes=max_bytes)
     for chunk in chunk_files:
         update_d1_table_from_dump(chunk, d1_mode)
 
@@ -236,22 +293,30 @@ def main():
     duckdb_filename = "wdi.duckdb"
     d1_mode = "local" if args.local else "remote"
 
-    with tempfile.TemporaryDirectory() as sqlite_dir:
-        sqlite_filename = os.path.join(sqlite_dir, "wdi.sqlite3")
+    with tempfile.TemporaryDirectory() as sql_dir:
         print(
-            f"Exporting selected tables to SQLite database in {sqlite_dir} ...")
-        export_duckdb_to_sqlite(
-            duckdb_filename, sqlite_filename, sample=args.sample, tables_to_export=changed_tables)
+            f"Exporting selected tables to SQL files in {sql_dir} ...")
+        exports = export_duckdb_to_sql(
+            duckdb_filename, sql_dir, sample=args.sample, tables_to_export=changed_tables)
         print(f"Dropping tables: {', '.join(changed_tables)}")
-        drop_mart_tables_from_d1(changed_tables, d1_mode, sqlite_dir)
-
-        for table in changed_tables:
-            print(f"Processing table {table} for D1 update...")
-            table_dump_file = os.path.join(sqlite_dir, f"{table}.sql")
-            dump_table_from_sqlite(sqlite_filename, table, table_dump_file)
+        drop_mart_tables_from_d1(
+            changed_tables, d1_mode, sql_dir,
+            create_statements=[create_statement for create_statement, _ in exports.values()])
+
+        # Every table's INSERTs go into one file so small tables share
+        # wrangler calls instead of starting one each.
+        combined_dump_file = os.path.join(sql_dir, "d1_inserts.sql")
+        with open(combined_dump_file, "wb") as combined:
+            for table, (_, table_dump_file) in exports.items():
+                if not table_dump_file:
+                    continue
+                print(f"Adding table {table} to the D1 update...")
+                with open(table_dump_file, "rb") as f:
+                    shutil.copyfileobj(f, combined)
+        if os.path.getsize(combined_dump_file):
             # Use our new function that handles splitting if the dump file is huge.
             update_d1_table_from_dump_chunks(
-                table_dump_file, d1_mode, max_lines=250000)
+                combined_dump_file, d1_mode, max_lines=D1_CHUNK_STATEMENTS, max_bytes=D1_CHUNK_BYTES)
         print("D1 update process complete.")
 
 